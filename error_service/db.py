@@ -1,25 +1,223 @@
 import os
-from sqlalchemy import create_engine
+import time
+from threading import Event, Lock, Thread
+
+from sqlalchemy import create_engine, event, inspect, make_url, text
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 # Cfolder for local sql lite
 DB_URL = os.getenv("DB_URL", "sqlite:///./errors.db")
 
-engine = create_engine(
-    DB_URL,
-    connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {},
-)
+# How long a write waits on a locked SQLite file before failing (and ingest spools instead)
+DB_BUSY_TIMEOUT_SECONDS = float(os.getenv("DB_BUSY_TIMEOUT_SECONDS", "1"))
+
+# Database servers: give up quickly on an unreachable host or an exhausted pool, so ingest spools fast
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "2"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "2"))
+
+# drivers taking connect_timeout (seconds) as a connect() argument
+_CONNECT_TIMEOUT_BACKENDS = {"postgresql", "mysql", "mariadb"}
+
+
+def _engine_args(url: str, busy_timeout: float) -> dict:
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False, "timeout": busy_timeout}}
+
+    args = {"pool_timeout": DB_POOL_TIMEOUT_SECONDS}
+    if make_url(url).get_backend_name() in _CONNECT_TIMEOUT_BACKENDS:
+        args["connect_args"] = {"connect_timeout": DB_CONNECT_TIMEOUT_SECONDS}
+    return args
+
+
+engine = create_engine(DB_URL, **_engine_args(DB_URL, DB_BUSY_TIMEOUT_SECONDS))
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# ---- Optional read engine for listing / reporting ----
+# READ_DB_URL: a replica; SQLITE_READ_ENGINE=1: read-only connections to the same SQLite file in WAL mode
+READ_DB_URL = os.getenv("READ_DB_URL")
+SQLITE_READ_ENGINE = os.getenv("SQLITE_READ_ENGINE", "0") == "1" and DB_URL.startswith("sqlite")
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "5"))
+READ_BUSY_TIMEOUT_SECONDS = float(os.getenv("READ_BUSY_TIMEOUT_SECONDS", "1"))
+
+# Replica reads fall back to the primary once the replica's heartbeat is older than this
+READ_MAX_STALENESS_SECONDS = float(os.getenv("READ_MAX_STALENESS_SECONDS", "5"))
+READ_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("READ_HEARTBEAT_INTERVAL_SECONDS", "1"))
+READ_PROBE_INTERVAL_SECONDS = 1.0
+
+# single-row table, see models.ReplicaHeartbeat
+HEARTBEAT_TABLE = "replica_heartbeat"
+
+read_engine = None
+
+if READ_DB_URL:
+    read_engine = create_engine(
+        READ_DB_URL,
+        pool_size=READ_POOL_SIZE,
+        **_engine_args(READ_DB_URL, READ_BUSY_TIMEOUT_SECONDS),
+    )
+
+elif SQLITE_READ_ENGINE:
+    @event.listens_for(engine, "connect")
+    def _wal_on_connect(dbapi_conn, _):
+        # WAL: readers never block the writer and the writer never blocks readers
+        dbapi_conn.execute("PRAGMA journal_mode=WAL")
+
+    _path = os.path.abspath(engine.url.database)
+    read_engine = create_engine(
+        f"sqlite:///file:{_path}?mode=ro&uri=true",
+        pool_size=READ_POOL_SIZE,
+        connect_args={"check_same_thread": False, "timeout": READ_BUSY_TIMEOUT_SECONDS},
+    )
+
+    @event.listens_for(read_engine, "connect")
+    def _query_only_on_connect(dbapi_conn, _):
+        dbapi_conn.execute("PRAGMA query_only=1")
+
+ReadSessionLocal = (
+    sessionmaker(bind=read_engine, autoflush=False, autocommit=False) if read_engine is not None else SessionLocal
+)
+
 
 class Base(DeclarativeBase):
     pass
 
 
+def add_missing_columns(bind=engine):
+    """
+    create_all() only creates missing tables. Columns added to a model later
+    (nullable or with a server_default) are added here so an existing
+    errors.db keeps working.
+    """
+    insp = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = CreateColumn(col).compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+class _ReplicaLag:
+    """
+    Lag measured on the replica itself: the primary keeps bumping a heartbeat
+    row (see _Heartbeat) and, at most once per READ_PROBE_INTERVAL_SECONDS,
+    the replica's copy of that row is read. Its age bounds how far behind the
+    replica is for every table, whoever wrote to the primary.
+    """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self._lock = Lock()
+        self._probed_at = 0.0
+        self._fresh = False
+        self.lag_seconds: float | None = None
+
+    def fresh(self) -> bool:
+        now = time.monotonic()
+        if now - self._probed_at < READ_PROBE_INTERVAL_SECONDS:
+            return self._fresh
+
+        with self._lock:
+            if now - self._probed_at < READ_PROBE_INTERVAL_SECONDS:
+                return self._fresh
+            self._probed_at = now
+
+            try:
+                with self.bind.connect() as conn:
+                    beat_at = conn.execute(text(f"SELECT MAX(beat_at) FROM {HEARTBEAT_TABLE}")).scalar()
+            except Exception as e:
+                print(f"[DB] Read replica probe failed, reading from primary: {e}")
+                beat_at = None
+
+            # no heartbeat replicated yet: unknown lag, read from the primary
+            self.lag_seconds = None if beat_at is None else max(0.0, time.time() - beat_at)
+            self._fresh = self.lag_seconds is not None and self.lag_seconds <= READ_MAX_STALENESS_SECONDS
+            return self._fresh
+
+
+class _Heartbeat:
+    """Writes the current time into the heartbeat row on the primary every READ_HEARTBEAT_INTERVAL_SECONDS."""
+
+    def __init__(self, bind):
+        self.bind = bind
+        self._stop = Event()
+        self._thread: Thread | None = None
+        self._failing = False
+
+    def beat(self) -> None:
+        try:
+            with self.bind.begin() as conn:
+                now = time.time()
+                if not conn.execute(text(f"UPDATE {HEARTBEAT_TABLE} SET beat_at = :t WHERE id = 1"), {"t": now}).rowcount:
+                    conn.execute(text(f"INSERT INTO {HEARTBEAT_TABLE} (id, beat_at) VALUES (1, :t)"), {"t": now})
+            self._failing = False
+        except Exception as e:
+            if not self._failing:
+                print(f"[DB] Replica heartbeat write failed: {e}")
+            self._failing = True
+
+    def _run(self) -> None:
+        while True:
+            self.beat()
+            if self._stop.wait(READ_HEARTBEAT_INTERVAL_SECONDS):
+                return
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="replica-heartbeat", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+# Only a separate replica can lag, the SQLite read engine reads the same file
+replica_lag = _ReplicaLag(read_engine) if READ_DB_URL else None
+heartbeat = _Heartbeat(engine) if READ_DB_URL else None
+
+
+def start_heartbeat() -> None:
+    if heartbeat is not None:
+        heartbeat.start()
+
+
+def stop_heartbeat() -> None:
+    if heartbeat is not None:
+        heartbeat.stop()
+
+
+def get_read_db():
+    """
+    Session for read-only endpoints: the read engine when configured and
+    within READ_MAX_STALENESS_SECONDS, the primary otherwise.
+    """
+    factory = SessionLocal
+    if read_engine is not None and (replica_lag is None or replica_lag.fresh()):
+        factory = ReadSessionLocal
+
+    db = factory()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,18 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException  
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import json
-
-from .db import Base, engine, get_db
-from .models import ErrorRecord, User, Service, NotificationRule
-from .schemas import ErrorIn, ErrorOut, ServiceIn, ServiceOut, UserIn, UserOut, RuleIn, RuleOut, RuleUserOut
+import os
+from typing import Callable, Literal
+from functools import partial
+import re
+import uuid
+
+from .db import Base, engine, get_db, get_read_db, add_missing_columns, SessionLocal, start_heartbeat, stop_heartbeat
+from .models import ErrorRecord, User, Service, NotificationRule, NotificationPatternRule, ErrorIdempotencyKey, ErrorAcknowledgement, PendingEscalation
+from .services import idempotency, rule_matcher, profiling
+from .services import heavy_hitters as hh
+from .services.heavy_hitters import heavy_hitters
+from .services.digest import Digest, DigestBuffer
+from .services.spool import Spool, SpoolReplayer, DB_UNAVAILABLE_ERRORS, to_record
+from .services.archive import archive, from_epoch
+from .services.admission import AdmissionController, AdmissionMiddleware
+from .services.line_listener import LineListener
+from .services.escalation import Escalation, EscalationScheduler
+from .repositories.rules import bulk_upsert_rules
+from .schemas import ErrorIn, ErrorOut, ErrorAcceptedOut, AckIn, AckOut, TopItemOut, ArchiveRunOut, ArchiveSegmentOut, Severity, ServiceIn, ServiceOut, UserIn, UserOut, RuleIn, RuleOut, RuleUserOut, RuleBulkIn, RuleBulkOut, PatternRuleIn, PatternRuleOut
 
 from io import BytesIO
-from fastapi.responses import Response
+from fastapi.responses import Response, JSONResponse
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from datetime import datetime
+from datetime import datetime, timedelta
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 
 from io import BytesIO
 from datetime import datetime
@@ -34,16 +50,32 @@ from openpyxl.chart.label import DataLabelList
 
 
 Base.metadata.create_all(bind=engine)
+add_missing_columns(bind=engine)
 
-app = FastAPI(title="Error Logging Service MVP")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:4200"],  # Angular dev server
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_heartbeat()
+    digests.start()
+    escalations.start()
+    hh.start(SessionLocal)
+    spool_replayer.start()
+    await line_listener.start()
+    yield
+    await line_listener.stop()
+    spool_replayer.stop()
+    hh.stop()
+    escalations.stop()
+    # flush buffered digests on shutdown
+    digests.stop()
+    stop_heartbeat()
+
+
+app = FastAPI(title="Error Logging Service MVP", lifespan=lifespan)
+
+# Opt-in per-request profiling + SQL statement counting (see services/profiling.py)
+app.router.route_class = profiling.ProfiledRoute
+app.add_middleware(profiling.ProfilingMiddleware)
 
 SEVERITY_RANK = {
     "INFO": 10,
@@ -56,6 +88,20 @@ def _sev_rank(sev: str | None) -> int:
     return SEVERITY_RANK.get((sev or "ERROR").strip().upper(), 30)
 
 
+# Admission control for POST /errors: bounded in-flight + queue, ERROR/CRITICAL first, 429 when full
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission, sev_rank=_sev_rank, high_rank=SEVERITY_RANK["ERROR"])
+
+# added last = outermost, so 429s from admission carry the CORS headers too
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:4200"],  # Angular dev server
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
 def send_email(user_id: int, service_name: str, severity: str, message: str, error_id: int):
     print(f"[ACTION] EMAIL -> user_id={user_id} service='{service_name}' severity={severity} error_id={error_id} msg='{message}'")
 
@@ -68,60 +114,113 @@ def send_text_or_call(user_id: int, service_name: str, severity: str, message: s
     print(f"[ACTION] CALL/TEXT -> user_id={user_id} service='{service_name}' severity={severity} error_id={error_id} msg='{message}'")
 
 
-def handle_error(machine_name: str, severity: str, message: str, error_id: int, db: Session):
+ACTIONS = {
+    "email": send_email,
+    "halo": create_halo_ticket,
+    "call": send_text_or_call,
+}
+
+
+def send_digest(d: Digest):
+    machines = d.machines
+    service_name = machines[0] if len(machines) == 1 else f"{len(machines)} services"
+    severity = max((sev for (_, sev) in d.counts), key=_sev_rank)
+
+    if d.total == 1:
+        # nothing to consolidate, send the original message
+        _, _, message, error_id = d.samples[0]
+        ACTIONS[d.channel](d.user_id, service_name, severity, message, error_id)
+        return
+
+    print(f"[DIGEST] {d.channel.upper()} -> user_id={d.user_id} errors={d.total} machines={len(machines)}")
+    ACTIONS[d.channel](d.user_id, service_name, severity, d.summary(), d.last_error_id)
+
+
+digests = DigestBuffer(dispatch=send_digest)
+
+
+def send_escalation(p: PendingEscalation):
+    ACTIONS[p.channel](p.user_id, p.service_name, p.severity, p.message, p.error_id)
+
+
+escalations = EscalationScheduler(session_factory=SessionLocal, dispatch=send_escalation)
+
+
+def handle_error(machine_name: str, severity: str, message: str, error_id: int, db: Session) -> Callable[[], None]:
     """
-    MVP rule evaluation:
-    - Resolve Service by name (case-insensitive)
-    - Find all enabled notification rules tied to that service
-    - For each rule: if rule.min_severity <= error.severity => perform actions
+    Rule evaluation, inside the transaction that stores the error; returns the
+    notifications to send once that transaction has committed.
+    - Match the machine against the compiled rule matcher
+      (exact service name, service group, glob/regex on the machine name)
+    - For each matching enabled rule: if rule.min_severity <= error.severity => perform actions
+    - A user matched by several rules gets each action once
+    - Escalating rules (escalate_after_minutes > 0) defer the call until the
+      error has gone unacknowledged that long; their rows are written with the error
     """
 
     machine_norm = (machine_name or "").strip()
     sev_norm = (severity or "ERROR").strip().upper()
 
-    # Resolve service (case-insensitive match)
-    service = (
-        db.query(Service)
-        .filter(func.upper(Service.name) == machine_norm.upper())
-        .first()
-    )
+    matcher = rule_matcher.get_matcher(db)
+    targets = matcher.match(machine_norm)
+    service_name = matcher.service_name(machine_norm)
 
-    if not service:
-        print(f"[RULES] No service found for machine='{machine_norm}'. Stored error_id={error_id}, no actions.")
-        return
-
-    # Load all enabled rules for this service
-    rules = (
-        db.query(NotificationRule)
-        .filter(
-            NotificationRule.service_id == service.id,
-            NotificationRule.enabled == True,  # noqa: E712
-        )
-        .all()
-    )
-
-    if not rules:
-        print(f"[RULES] No rules for service='{service.name}'. Stored error_id={error_id}, no actions.")
-        return
+    if not targets:
+        if not service_name:
+            print(f"[RULES] No service found for machine='{machine_norm}'. Stored error_id={error_id}, no actions.")
+        else:
+            print(f"[RULES] No rules for service='{service_name}'. Stored error_id={error_id}, no actions.")
+        return lambda: None
 
+    service_name = service_name or machine_norm
     err_rank = _sev_rank(sev_norm)
+    done: set[tuple[int, str]] = set()
+    escalate: list[Escalation] = []
+    actions: list[Callable[[], None]] = []
 
-    for rule in rules:
+    for rule in targets:
         rule_rank = _sev_rank(rule.min_severity)
 
         # Minimum severity check
         if err_rank < rule_rank:
             continue
 
-        # Action bits -> call stub functions
-        if rule.do_email:
-            send_email(rule.user_id, service.name, sev_norm, message, error_id)
-
-        if rule.do_halo_ticket:
-            create_halo_ticket(rule.user_id, service.name, sev_norm, message, error_id)
+        # Digest rules buffer per (user, channel); CRITICAL may bypass the window
+        digest = rule.digest_window_seconds > 0 and not (
+            rule.digest_bypass_critical and sev_norm == "CRITICAL"
+        )
 
-        if rule.do_call:
-            send_text_or_call(rule.user_id, service.name, sev_norm, message, error_id)
+        # Action bits -> call stub functions
+        for channel, wanted in (("email", rule.do_email), ("halo", rule.do_halo_ticket), ("call", rule.do_call)):
+            if not wanted or (rule.user_id, channel) in done:
+                continue
+            done.add((rule.user_id, channel))
+
+            if channel == "call" and rule.escalate_after_minutes > 0:
+                escalate.append(Escalation(
+                    error_id=error_id,
+                    user_id=rule.user_id,
+                    channel=channel,
+                    delay_seconds=rule.escalate_after_minutes * 60,
+                    service_name=service_name,
+                    severity=sev_norm,
+                    message=message,
+                ))
+            elif digest:
+                actions.append(partial(digests.add, rule.user_id, channel, rule.digest_window_seconds, service_name, sev_norm, message, error_id))
+            else:
+                actions.append(partial(ACTIONS[channel], rule.user_id, service_name, sev_norm, message, error_id))
+
+    armed = escalations.stage(db, escalate)
+    if armed:
+        print(f"[RULES] error_id={error_id}: {len(armed)} call(s) deferred until unacknowledged")
+
+    def notify():
+        escalations.arm(armed)
+        for action in actions:
+            action()
+
+    return notify
 
 
 @app.get("/health")
@@ -129,39 +228,209 @@ def health():
     return {"status": "ok"}
 
 
-@app.post("/errors", response_model=ErrorOut, status_code=201)
-def create_error(payload: ErrorIn, db: Session = Depends(get_db)):
-    rec = ErrorRecord(
-        machine=payload.machine.strip().upper(),
-        message=payload.message.strip(),
-        severity=(payload.severity or "ERROR"),
-        raw_payload=json.dumps(payload.model_dump(mode="json"), ensure_ascii=False),
-    )
-    db.add(rec)
-    db.commit()
-    db.refresh(rec)
+@app.get("/admin/profiles")
+def list_profiles(request: Request):
+    if not profiling.is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return profiling.list_reports()
+
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request):
+    if not profiling.is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
+    report = profiling.get_report(profile_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
+
+
+def _stage_post_store(out: ErrorOut, db: Session) -> Callable[[], None]:
+    """
+    Post-store pipeline of a new error, in two steps: rule evaluation writes
+    its escalation rows in the transaction storing the error, the returned
+    step (stats + notifications) runs after it has committed.
+    """
     # evaluate rules + run actions (MVP prints)
-    handle_error(
-        machine_name=rec.machine,
-        severity=rec.severity,
-        message=rec.message,
-        error_id=rec.id,
+    notify = handle_error(
+        machine_name=out.machine,
+        severity=out.severity,
+        message=out.message,
+        error_id=out.id,
         db=db,
     )
 
-    return ErrorOut(
-        id=rec.id,
-        created_at=rec.created_at,
-        machine=rec.machine,
-        message=rec.message,
-        severity=rec.severity,
+    def after_commit():
+        heavy_hitters.record(out.machine, out.message, out.created_at)
+        notify()
+
+    return after_commit
+
+
+error_spool = Spool()
+spool_replayer = SpoolReplayer(error_spool, session_factory=SessionLocal, on_insert=_stage_post_store)
+
+# TCP/UDP "MACHINE SEVERITY message" ingestion, off unless LINE_TCP_PORT / LINE_UDP_PORT is set
+line_listener = LineListener(session_factory=SessionLocal, on_insert=_stage_post_store, spool=error_spool)
+
+
+@app.post(
+    "/errors",
+    response_model=ErrorOut,
+    status_code=201,
+    responses={202: {"model": ErrorAcceptedOut, "description": "Database unavailable, event spooled for replay"}},
+)
+def create_error(
+    payload: ErrorIn,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=200),
+    db: Session = Depends(get_db),
+):
+    key = idempotency.normalize_key(idempotency_key, payload.event_id)
+
+    machine = payload.machine.strip().upper()
+    message = payload.message.strip()
+    severity = (payload.severity or "ERROR")
+    raw_payload = json.dumps(payload.model_dump(mode="json"), ensure_ascii=False)
+
+    try:
+        # ---- Retry of an already stored event? Return the original ----
+        if key:
+            existing = idempotency.lookup(db, key)
+            if existing:
+                return existing
+
+        rec = ErrorRecord(
+            machine=machine,
+            message=message,
+            severity=severity,
+            raw_payload=raw_payload,
+        )
+        db.add(rec)
+        db.flush()
+
+        if key:
+            # same transaction as the error row, the unique index settles concurrent retries
+            db.add(ErrorIdempotencyKey(key=key, error_id=rec.id))
+
+        # snapshot before commit: nothing after a successful commit may fall into the spool path below
+        out = ErrorOut(
+            id=rec.id,
+            created_at=rec.created_at,
+            machine=rec.machine,
+            message=rec.message,
+            severity=rec.severity,
+        )
+        after_commit = _stage_post_store(out, db)
+
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            existing = idempotency.find_error_by_key(db, key) if key else None
+            if not existing:
+                raise
+            idempotency.idempotency_cache.put(key, existing)
+            return existing
+
+    except DB_UNAVAILABLE_ERRORS as e:
+        # ---- DB locked or down: spool locally, the replayer stores it exactly once ----
+        db.rollback()
+        spool_key = key or f"spool:{uuid.uuid4().hex}"
+        error_spool.append(to_record(spool_key, machine, message, severity, raw_payload))
+        print(f"[SPOOL] DB unavailable ({e.__class__.__name__}), spooled machine='{machine}' key={spool_key}")
+        return JSONResponse(status_code=202, content=ErrorAcceptedOut(idempotency_key=spool_key).model_dump())
+
+    if key:
+        idempotency.idempotency_cache.put(key, out)
+
+    # the error is committed: a failing notification must not fail the request
+    try:
+        after_commit()
+    except Exception as e:
+        print(f"[RULES] Post-store handling failed for error_id={out.id}: {e}")
+
+    return out
+
+
+@app.post("/errors/{error_id}/ack", response_model=AckOut)
+def acknowledge_error(error_id: int, payload: AckIn | None = None, db: Session = Depends(get_db)):
+    if not db.get(ErrorRecord, error_id):
+        raise HTTPException(status_code=404, detail="Error not found")
+
+    ack = db.query(ErrorAcknowledgement).filter(ErrorAcknowledgement.error_id == error_id).first()
+    if ack is None:
+        ack = ErrorAcknowledgement(error_id=error_id, acknowledged_by=payload.acknowledged_by if payload else None)
+        db.add(ack)
+
+    cancelled = escalations.cancel_error(db, error_id)
+    try:
+        db.commit()
+    except IntegrityError:
+        # acknowledged concurrently, the first one stands
+        db.rollback()
+        ack = db.query(ErrorAcknowledgement).filter(ErrorAcknowledgement.error_id == error_id).one()
+
+    return AckOut(
+        error_id=error_id,
+        acknowledged_at=ack.created_at,
+        acknowledged_by=ack.acknowledged_by,
+        cancelled_escalations=cancelled,
     )
 
 
+@app.get("/metrics/escalations")
+def escalation_metrics():
+    return escalations.metrics()
+
+
+@app.get("/metrics/admission")
+def admission_metrics():
+    return admission.metrics()
+
+
+@app.get("/metrics/line-listener")
+def line_listener_metrics():
+    return line_listener.metrics()
+
+
+@app.get("/spool/status")
+def spool_status():
+    return {
+        "pending_bytes": error_spool.pending_bytes(),
+        "replayed": spool_replayer.replayed,
+        "skipped_duplicates": spool_replayer.skipped_duplicates,
+        "last_error": spool_replayer.last_error,
+    }
+
+
+
+# the windows only reach this far back
+TOP_MAX_HOURS = max(1, hh.HH_WINDOWS * hh.HH_WINDOW_SECONDS // 3600)
+
+
+@app.get("/stats/top", response_model=list[TopItemOut])
+def stats_top(
+    dimension: Literal["machine", "message"] = "machine",
+    n: int = 10,
+    hours: int | None = Query(None, ge=1, le=TOP_MAX_HOURS),
+):
+    # Approximate counts from the streaming summary; hours=None means all-time
+    return [TopItemOut(key=k, count=v) for k, v in heavy_hitters.top(dimension, n, hours)]
+
+
+REPORT_TOP_N = 5
+
+
+def _report_top(dimension: str) -> tuple[list[str], list[int]]:
+    top = heavy_hitters.top(dimension, REPORT_TOP_N)
+    if not top:
+        return ["(no data)"], [0]
+    return [k for k, _ in top], [v for _, v in top]
+
 
 @app.get("/errors", response_model=list[ErrorOut])
-def list_errors(limit: int = 50, db: Session = Depends(get_db)):
+def list_errors(limit: int = 50, db: Session = Depends(get_read_db)):
     rows = (
         db.query(ErrorRecord)
         .order_by(ErrorRecord.id.desc())
@@ -179,6 +448,55 @@ def list_errors(limit: int = 50, db: Session = Depends(get_db)):
         for r in rows
     ]
 
+@app.post("/archive/run", response_model=ArchiveRunOut)
+def run_archive(older_than_days: int = 365, db: Session = Depends(get_db)):
+    # Move old errors out of the live table into compressed column segments
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be >= 1")
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    try:
+        return ArchiveRunOut(**archive.run(db, cutoff, _sev_rank))
+    except FileExistsError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/archive/segments", response_model=list[ArchiveSegmentOut])
+def list_archive_segments():
+    return [
+        ArchiveSegmentOut(
+            file=os.path.basename(seg.path),
+            rows=seg.footer["rows"],
+            id_min=seg.footer["id_min"],
+            id_max=seg.footer["id_max"],
+            created_from=from_epoch(seg.footer["t_min"]),
+            created_to=from_epoch(seg.footer["t_max"]),
+            machine_min=seg.footer["machine_min"],
+            machine_max=seg.footer["machine_max"],
+        )
+        for seg in archive.segments()
+    ]
+
+
+@app.get("/archive/errors", response_model=list[ErrorOut])
+def query_archive(
+    since: datetime | None = None,
+    until: datetime | None = None,
+    machine: str | None = None,
+    min_severity: Severity | None = None,
+    limit: int = 100,
+):
+    return archive.query(
+        since=since,
+        until=until,
+        machine=machine,
+        min_rank=_sev_rank(min_severity) if min_severity else None,
+        sev_rank=_sev_rank,
+        limit=limit,
+    )
+
+
 @app.get("/services", response_model=list[ServiceOut])
 def list_services(limit: int = 200, db: Session = Depends(get_db)):
     rows = (
@@ -212,6 +530,7 @@ def create_service(payload: ServiceIn, db: Session = Depends(get_db)):
     db.add(rec)
     db.commit()
     db.refresh(rec)
+    rule_matcher.invalidate()
 
     return ServiceOut(id=rec.id, created_at=rec.created_at, name=rec.name, group=rec.group)
 
@@ -294,6 +613,9 @@ def list_rules(limit: int = 200, db: Session = Depends(get_db)):
             do_email=r.do_email,
             do_call=r.do_call,
             do_halo_ticket=r.do_halo_ticket,
+            digest_window_seconds=r.digest_window_seconds,
+            digest_bypass_critical=r.digest_bypass_critical,
+            escalate_after_minutes=r.escalate_after_minutes,
         )
         for r in rows
     ]
@@ -306,6 +628,7 @@ def delete_rule(rule_id: int, db: Session = Depends(get_db)):
 
     db.delete(rule)
     db.commit()
+    rule_matcher.invalidate()
     return
 
 
@@ -379,6 +702,9 @@ def create_rule(payload: RuleIn, db: Session = Depends(get_db)):
         existing.do_email = payload.do_email
         existing.do_call = payload.do_call
         existing.do_halo_ticket = payload.do_halo_ticket
+        existing.digest_window_seconds = payload.digest_window_seconds
+        existing.digest_bypass_critical = payload.digest_bypass_critical
+        existing.escalate_after_minutes = payload.escalate_after_minutes
         db.commit()
         db.refresh(existing)
         r = existing
@@ -391,11 +717,16 @@ def create_rule(payload: RuleIn, db: Session = Depends(get_db)):
             do_email=payload.do_email,
             do_call=payload.do_call,
             do_halo_ticket=payload.do_halo_ticket,
+            digest_window_seconds=payload.digest_window_seconds,
+            digest_bypass_critical=payload.digest_bypass_critical,
+            escalate_after_minutes=payload.escalate_after_minutes,
         )
         db.add(r)
         db.commit()
         db.refresh(r)
 
+    rule_matcher.invalidate()
+
     return RuleOut(
         id=r.id,
         created_at=r.created_at,
@@ -406,30 +737,133 @@ def create_rule(payload: RuleIn, db: Session = Depends(get_db)):
         do_email=r.do_email,
         do_call=r.do_call,
         do_halo_ticket=r.do_halo_ticket,
+        digest_window_seconds=r.digest_window_seconds,
+        digest_bypass_critical=r.digest_bypass_critical,
+        escalate_after_minutes=r.escalate_after_minutes,
     )
 
-@app.get("/rules/by-machine", response_model=list[RuleUserOut])
-def rules_by_machine(machine: str, db: Session = Depends(get_db)):
-    machine_norm = machine.strip()
+@app.post("/rules/bulk", response_model=RuleBulkOut)
+def create_rules_bulk(payload: RuleBulkIn, db: Session = Depends(get_db)):
+    # One transaction for the whole batch: no half-created users on failure
+    try:
+        out = bulk_upsert_rules(db, payload.rules)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Bulk provisioning conflicted with a concurrent change, nothing was written.")
 
-    service = (
-        db.query(Service)
-        .filter(func.upper(Service.name) == machine_norm.upper())
-        .first()
+    rule_matcher.invalidate()
+    return out
+
+def _pattern_rule_out(r: NotificationPatternRule) -> PatternRuleOut:
+    return PatternRuleOut(
+        id=r.id,
+        created_at=r.created_at,
+        user_id=r.user_id,
+        target_group=r.target_group,
+        machine_pattern=r.machine_pattern,
+        pattern_type=r.pattern_type,
+        min_severity=r.min_severity,
+        enabled=r.enabled,
+        do_email=r.do_email,
+        do_call=r.do_call,
+        do_halo_ticket=r.do_halo_ticket,
+        digest_window_seconds=r.digest_window_seconds,
+        digest_bypass_critical=r.digest_bypass_critical,
+        escalate_after_minutes=r.escalate_after_minutes,
     )
-    if not service:
-        return []
 
+
+@app.get("/rules/patterns", response_model=list[PatternRuleOut])
+def list_pattern_rules(limit: int = 200, db: Session = Depends(get_db)):
     rows = (
-        db.query(NotificationRule, User)
-        .join(User, User.id == NotificationRule.user_id)
+        db.query(NotificationPatternRule)
+        .order_by(NotificationPatternRule.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [_pattern_rule_out(r) for r in rows]
+
+
+@app.post("/rules/patterns", response_model=PatternRuleOut, status_code=201)
+def create_pattern_rule(payload: PatternRuleIn, db: Session = Depends(get_db)):
+    group = payload.target_group.strip() if payload.target_group else None
+    pattern = payload.machine_pattern.strip() if payload.machine_pattern else None
+
+    # ---- Validate target ----
+    if bool(group) == bool(pattern):
+        raise HTTPException(status_code=400, detail="Provide either target_group or machine_pattern.")
+
+    if pattern:
+        try:
+            rule_matcher.compile_pattern(pattern, payload.pattern_type)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {payload.pattern_type} pattern: {e}")
+
+    if not db.query(User).filter(User.id == payload.user_id).first():
+        raise HTTPException(status_code=400, detail="Unknown user_id")
+
+    if group and not db.query(Service).filter(Service.group == group).first():
+        raise HTTPException(status_code=400, detail="Unknown target_group")
+
+    # ---- Upsert rule by (user_id, target) ----
+    existing = (
+        db.query(NotificationPatternRule)
         .filter(
-            NotificationRule.service_id == service.id,
-            NotificationRule.enabled == True,  # noqa: E712
+            NotificationPatternRule.user_id == payload.user_id,
+            NotificationPatternRule.target_group == group,
+            NotificationPatternRule.machine_pattern == pattern,
+            NotificationPatternRule.pattern_type == payload.pattern_type,
         )
-        .order_by(User.last_name.asc(), User.first_name.asc())
-        .all()
+        .first()
+    )
+
+    r = existing or NotificationPatternRule(
+        user_id=payload.user_id,
+        target_group=group,
+        machine_pattern=pattern,
+        pattern_type=payload.pattern_type,
     )
+    r.min_severity = payload.min_severity
+    r.enabled = payload.enabled
+    r.do_email = payload.do_email
+    r.do_call = payload.do_call
+    r.do_halo_ticket = payload.do_halo_ticket
+    r.digest_window_seconds = payload.digest_window_seconds
+    r.digest_bypass_critical = payload.digest_bypass_critical
+    r.escalate_after_minutes = payload.escalate_after_minutes
+
+    if not existing:
+        db.add(r)
+    db.commit()
+    db.refresh(r)
+    rule_matcher.invalidate()
+
+    return _pattern_rule_out(r)
+
+
+@app.delete("/rules/patterns/{rule_id}", status_code=204)
+def delete_pattern_rule(rule_id: int, db: Session = Depends(get_db)):
+    rule = db.query(NotificationPatternRule).filter(NotificationPatternRule.id == rule_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    db.delete(rule)
+    db.commit()
+    rule_matcher.invalidate()
+    return
+
+@app.get("/rules/by-machine", response_model=list[RuleUserOut])
+def rules_by_machine(machine: str, db: Session = Depends(get_db)):
+    # Same resolution as handle_error: exact service, service group and machine patterns.
+    # Primary session: the matcher is shared with ingestion and must not be built from a lagging replica.
+    targets = rule_matcher.get_matcher(db).match(machine)
+    if not targets:
+        return []
+
+    users = {u.id: u for u in db.query(User).filter(User.id.in_({t.user_id for t in targets}))}
+
+    rows = [(t, users[t.user_id]) for t in targets if t.user_id in users]
+    rows.sort(key=lambda tu: (tu[1].last_name, tu[1].first_name, tu[0].kind, tu[0].rule_id))
 
     return [
         RuleUserOut(
@@ -439,19 +873,20 @@ def rules_by_machine(machine: str, db: Session = Depends(get_db)):
             email=u.email,
             phone_number=u.phone_number,
 
-            rule_id=r.id,
-            enabled=r.enabled,
-            min_severity=r.min_severity,
-            do_email=r.do_email,
-            do_call=r.do_call,
-            do_halo_ticket=r.do_halo_ticket,
+            rule_id=t.rule_id,
+            rule_kind=t.kind,
+            enabled=True,  # the matcher only holds enabled rules
+            min_severity=t.min_severity,
+            do_email=t.do_email,
+            do_call=t.do_call,
+            do_halo_ticket=t.do_halo_ticket,
         )
-        for (r, u) in rows
+        for (t, u) in rows
     ]
 
 
 @app.get("/report/health.pdf")
-def health_report_pdf(db: Session = Depends(get_db)):
+def health_report_pdf(db: Session = Depends(get_read_db)):
     # Example metric: last 10 errors
     rows = (
         db.query(ErrorRecord)
@@ -505,14 +940,13 @@ def health_report_pdf(db: Session = Depends(get_db)):
     y = pie_y - 20
 
     # =========================
-    # 2) BAR CHART (mock data)
+    # 2) BAR CHART (top machines, streaming summary)
     # =========================
     c.setFont("Helvetica-Bold", 12)
     c.drawString(50, y, "Errors per machine")
     y -= 10
 
-    machines = ["IMA-01", "CEFLA-02", "AGV-07", "BOX-01", "PALL-03"]
-    machine_counts = [4, 2, 6, 1, 3]
+    machines, machine_counts = _report_top("machine")
 
     bar = VerticalBarChart()
     bar.x = 40
@@ -523,7 +957,7 @@ def health_report_pdf(db: Session = Depends(get_db)):
     bar.categoryAxis.categoryNames = machines
     bar.valueAxis.valueMin = 0
     bar.valueAxis.valueMax = max(machine_counts) + 2
-    bar.valueAxis.valueStep = 1
+    bar.valueAxis.valueStep = max(1, max(machine_counts) // 10)
     bar.barWidth = 18
     bar.groupSpacing = 10
 
@@ -542,7 +976,25 @@ def health_report_pdf(db: Session = Depends(get_db)):
     y = bar_y - 30
 
     # =========================
-    # 3) TABLE-ish LIST (your existing section)
+    # 3) NOISIEST MESSAGES (streaming summary)
+    # =========================
+    if y < 120:
+        c.showPage()
+        y = height - 50
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, y, "Noisiest messages")
+    y -= 20
+
+    c.setFont("Helvetica", 10)
+    for msg, n in zip(*_report_top("message")):
+        c.drawString(50, y, f"{n:>6}  {msg}"[:120])
+        y -= 14
+
+    y -= 16
+
+    # =========================
+    # 4) TABLE-ish LIST (your existing section)
     # =========================
     if y < 120:
         c.showPage()
@@ -574,13 +1026,19 @@ def health_report_pdf(db: Session = Depends(get_db)):
 
 @app.delete("/errors", status_code=204)
 def delete_all_errors(db: Session = Depends(get_db)):
+    db.query(ErrorIdempotencyKey).delete()
+    db.query(ErrorAcknowledgement).delete()
+    db.query(PendingEscalation).delete()
     db.query(ErrorRecord).delete()
     db.commit()
+    escalations.clear()
+    idempotency.idempotency_cache.clear()
+    heavy_hitters.clear()
     return
 
 
 @app.get("/report/health.xlsx")
-def health_report_excel(db: Session = Depends(get_db)):
+def health_report_excel(db: Session = Depends(get_read_db)):
     # Latest 10 errors (real data)
     rows = (
         db.query(ErrorRecord)
@@ -644,9 +1102,8 @@ def health_report_excel(db: Session = Depends(get_db)):
         ws_data[f"A{i}"] = lab
         ws_data[f"B{i}"] = val
 
-    # Mock machine counts
-    machines = ["IMA-01", "CEFLA-02", "AGV-07", "BOX-01", "PALL-03"]
-    machine_counts = [4, 2, 6, 1, 3]
+    # Top machines from the streaming summary
+    machines, machine_counts = _report_top("machine")
 
     ws_data["D3"] = "Errors per machine"
     ws_data["D3"].font = Font(bold=True)
@@ -698,8 +1155,9 @@ def health_report_excel(db: Session = Depends(get_db)):
     bar.y_axis.title = "Count"
     bar.x_axis.title = "Machine"
 
-    bar_data = Reference(ws_data, min_col=5, min_row=4, max_row=9)   # E4:E9 includes header
-    bar_cats = Reference(ws_data, min_col=4, min_row=5, max_row=9)   # D5:D9
+    bar_last_row = 4 + len(machines)
+    bar_data = Reference(ws_data, min_col=5, min_row=4, max_row=bar_last_row)   # E4:E.. includes header
+    bar_cats = Reference(ws_data, min_col=4, min_row=5, max_row=bar_last_row)   # D5:D..
     bar.add_data(bar_data, titles_from_data=True)
     bar.set_categories(bar_cats)
 
@@ -708,6 +1166,24 @@ def health_report_excel(db: Session = Depends(get_db)):
 
     ws_charts.add_chart(bar, "A20")
 
+    # =========================
+    # Sheet 4: TopMessages
+    # =========================
+    ws_msgs = wb.create_sheet("TopMessages")
+    ws_msgs["A1"] = "Noisiest messages"
+    ws_msgs["A1"].font = Font(bold=True, size=14)
+
+    ws_msgs.append([])
+    ws_msgs.append(["Count", "Message"])
+    for col_idx in (1, 2):
+        ws_msgs.cell(row=ws_msgs.max_row, column=col_idx).font = Font(bold=True)
+
+    for msg, n in zip(*_report_top("message")):
+        ws_msgs.append([n, msg])
+
+    ws_msgs.column_dimensions["A"].width = 10
+    ws_msgs.column_dimensions["B"].width = 80
+
     # Optional: hide the SummaryData sheet so users just see LatestErrors + Charts
     ws_data.sheet_state = "hidden"
 
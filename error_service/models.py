@@ -1,9 +1,9 @@
 from datetime import datetime
-from sqlalchemy import String, DateTime, Integer, Text, UniqueConstraint, ForeignKey, Boolean
+from sqlalchemy import String, DateTime, Integer, Float, Text, UniqueConstraint, ForeignKey, Boolean, true
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 
-from .db import Base
+from .db import Base, HEARTBEAT_TABLE
 
 
 class ErrorRecord(Base):
@@ -18,6 +18,9 @@ class ErrorRecord(Base):
 
     raw_payload: Mapped[str] = mapped_column(Text, nullable=False)
 
+    # never reuse ids of archived/deleted errors (new databases only, SQLite cannot alter an existing table)
+    __table_args__ = {"sqlite_autoincrement": True}
+
 class User(Base):
     __tablename__ = "users"
 
@@ -66,6 +69,13 @@ class NotificationRule(Base):
     do_call: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     do_halo_ticket: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
 
+    # Digest mode: 0 = send immediately, otherwise batch per (user, channel) for this many seconds
+    digest_window_seconds: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    digest_bypass_critical: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true(), nullable=False)
+
+    # Escalation: 0 = call immediately, otherwise call only if nobody acknowledged the error within this many minutes
+    escalate_after_minutes: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
     user = relationship("User")
     service = relationship("Service")
 
@@ -73,3 +83,97 @@ class NotificationRule(Base):
         UniqueConstraint("user_id", "service_id", "min_severity", name="uq_rule_user_service_minsev"),
     )
 
+
+class ErrorIdempotencyKey(Base):
+    __tablename__ = "error_idempotency_keys"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Idempotency-Key header or ErrorIn.event_id sent by the client
+    key: Mapped[str] = mapped_column(String(200), nullable=False)
+    error_id: Mapped[int] = mapped_column(ForeignKey("errors.id"), nullable=False, index=True)
+
+    error = relationship("ErrorRecord")
+
+    __table_args__ = (
+        UniqueConstraint("key", name="uq_error_idempotency_key"),
+        {"sqlite_autoincrement": True},
+    )
+
+# Rule targeting a whole Service.group or a glob/regex on the machine name
+class NotificationPatternRule(Base):
+    __tablename__ = "notification_pattern_rules"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+
+    # exactly one of target_group / machine_pattern is set
+    target_group: Mapped[str] = mapped_column(String(100), nullable=True, index=True)
+    machine_pattern: Mapped[str] = mapped_column(String(200), nullable=True)
+    pattern_type: Mapped[str] = mapped_column(String(10), default="glob", nullable=False)  # glob/regex
+
+    min_severity: Mapped[str] = mapped_column(String(20), nullable=False)  # INFO/WARN/ERROR/CRITICAL
+    enabled: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+
+    do_email: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    do_call: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    do_halo_ticket: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+
+    # Digest mode: 0 = send immediately, otherwise batch per (user, channel) for this many seconds
+    digest_window_seconds: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    digest_bypass_critical: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true(), nullable=False)
+
+    # Escalation: 0 = call immediately, otherwise call only if nobody acknowledged the error within this many minutes
+    escalate_after_minutes: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
+    user = relationship("User")
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class ErrorAcknowledgement(Base):
+    __tablename__ = "error_acknowledgements"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    error_id: Mapped[int] = mapped_column(ForeignKey("errors.id"), nullable=False, index=True)
+    acknowledged_by: Mapped[str] = mapped_column(String(255), nullable=True)
+
+    error = relationship("ErrorRecord")
+
+    __table_args__ = (
+        UniqueConstraint("error_id", name="uq_error_acknowledgement_error"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+# Escalation timer waiting for its deadline; deleted when it fires or the error is acknowledged
+class PendingEscalation(Base):
+    __tablename__ = "pending_escalations"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    due_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    # not a FK: the row carries everything needed to fire and outlives archiving of the error
+    error_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    channel: Mapped[str] = mapped_column(String(20), default="call", nullable=False)
+
+    service_name: Mapped[str] = mapped_column(String(150), nullable=False)
+    severity: Mapped[str] = mapped_column(String(20), nullable=False)
+    message: Mapped[str] = mapped_column(String(2000), nullable=False)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+# Bumped on the primary, read on the replica to measure replication lag (db._ReplicaLag)
+class ReplicaHeartbeat(Base):
+    __tablename__ = HEARTBEAT_TABLE
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    beat_at: Mapped[float] = mapped_column(Float, nullable=False)  # unix time on the primary
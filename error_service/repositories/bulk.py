@@ -0,0 +1,19 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+
+def insert_many(db: Session, model, rows: list[dict]) -> list:
+    """
+    Multi-row INSERT .. RETURNING in one statement where the dialect supports it.
+    Row order of the result is not guaranteed, callers match on natural keys.
+    """
+    if not rows:
+        return []
+
+    if db.get_bind().dialect.insert_executemany_returning:
+        return db.scalars(insert(model).returning(model), rows).all()
+
+    objs = [model(**row) for row in rows]
+    db.add_all(objs)
+    db.flush()
+    return objs
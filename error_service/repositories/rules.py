@@ -0,0 +1,177 @@
+from sqlalchemy.orm import Session
+
+from .bulk import insert_many
+from ..models import User, Service, NotificationRule
+from ..schemas import RuleIn, RuleOut, RuleBulkItemOut, RuleBulkOut
+
+# Stay well below SQLite's bound parameter limit
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(values: list, size: int = IN_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _load_in(db: Session, model, column, values: set) -> list:
+    rows = []
+    for chunk in _chunks(sorted(values)):
+        rows.extend(db.query(model).filter(column.in_(chunk)).all())
+    return rows
+
+
+def _rule_out(r: NotificationRule) -> RuleOut:
+    return RuleOut(
+        id=r.id,
+        created_at=r.created_at,
+        user_id=r.user_id,
+        service_id=r.service_id,
+        min_severity=r.min_severity,
+        enabled=r.enabled,
+        do_email=r.do_email,
+        do_call=r.do_call,
+        do_halo_ticket=r.do_halo_ticket,
+        digest_window_seconds=r.digest_window_seconds,
+        digest_bypass_critical=r.digest_bypass_critical,
+        escalate_after_minutes=r.escalate_after_minutes,
+    )
+
+
+def bulk_upsert_rules(db: Session, items: list[RuleIn]) -> RuleBulkOut:
+    """
+    Set-based version of POST /rules:
+    - Resolve all user ids, user emails and service ids with one IN query each (chunked)
+    - Insert missing users and new rules with one multi-row INSERT each
+    - Upsert rules by (user_id, service_id), committed once; the caller rolls back on failure
+
+    Items that fail validation are reported per index and do not create users.
+    """
+
+    # ---- Collect keys ----
+    user_ids = {it.user_id for it in items if it.user_id is not None}
+    emails = {it.user.email.strip().lower() for it in items if it.user}
+    service_ids = {it.service_id for it in items}
+
+    users_by_id = {u.id: u for u in _load_in(db, User, User.id, user_ids)}
+    users_by_email = {u.email: u for u in _load_in(db, User, User.email, emails)}
+    known_services = {s.id for s in _load_in(db, Service, Service.id, service_ids)}
+
+    # ---- Resolve users per item ----
+    errors: dict[int, str] = {}
+    resolved: dict[int, User | str] = {}  # User, or email of a user still to be created
+    new_users: dict[str, dict] = {}
+
+    for idx, it in enumerate(items):
+        if it.service_id not in known_services:
+            errors[idx] = "Unknown service_id"
+            continue
+
+        user = users_by_id.get(it.user_id) if it.user_id is not None else None
+
+        if not user:
+            if not it.user:
+                errors[idx] = (
+                    "Unknown user_id (and no user payload provided to auto-create)."
+                    if it.user_id is not None
+                    else "Provide either user_id or user."
+                )
+                continue
+
+            email = it.user.email.strip().lower()
+            user = users_by_email.get(email)
+
+            if not user:
+                new_users.setdefault(email, dict(
+                    first_name=it.user.first_name.strip(),
+                    last_name=it.user.last_name.strip(),
+                    role=it.user.role.strip(),
+                    email=email,
+                    phone_number=(it.user.phone_number.strip() if it.user.phone_number else None),
+                ))
+                user = email
+
+        resolved[idx] = user
+
+    # one statement inserts all new users and gives them ids
+    for u in insert_many(db, User, list(new_users.values())):
+        users_by_email[u.email] = u
+
+    user_ids_by_idx = {
+        idx: (users_by_email[u].id if isinstance(u, str) else u.id)
+        for idx, u in resolved.items()
+    }
+
+    # ---- Load existing rules for every (user_id, service_id) pair we touch ----
+    # filter by user only, a user has few rules and this keeps one IN list per query
+    touched_users = set(user_ids_by_idx.values())
+    touched_services = {items[idx].service_id for idx in resolved}
+
+    existing: dict[tuple[int, int], NotificationRule] = {}
+    for chunk in _chunks(sorted(touched_users)):
+        rows = (
+            db.query(NotificationRule)
+            .filter(NotificationRule.user_id.in_(chunk))
+            .order_by(NotificationRule.id.asc())
+            .all()
+        )
+        for r in rows:
+            if r.service_id in touched_services:
+                existing.setdefault((r.user_id, r.service_id), r)
+
+    # ---- Upsert (last item wins when a batch repeats a pair) ----
+    statuses: dict[int, str] = {}
+    pairs: dict[int, tuple[int, int]] = {}
+    new_rules: dict[tuple[int, int], dict] = {}
+
+    for idx, user_id in user_ids_by_idx.items():
+        it = items[idx]
+        pair = (user_id, it.service_id)
+        values = dict(
+            min_severity=it.min_severity,
+            enabled=it.enabled,
+            do_email=it.do_email,
+            do_call=it.do_call,
+            do_halo_ticket=it.do_halo_ticket,
+            digest_window_seconds=it.digest_window_seconds,
+            digest_bypass_critical=it.digest_bypass_critical,
+            escalate_after_minutes=it.escalate_after_minutes,
+        )
+
+        r = existing.get(pair)
+        if r:
+            for k, v in values.items():
+                setattr(r, k, v)
+            statuses[idx] = "updated"
+        elif pair in new_rules:
+            new_rules[pair].update(values)
+            statuses[idx] = "updated"
+        else:
+            new_rules[pair] = dict(user_id=user_id, service_id=it.service_id, **values)
+            statuses[idx] = "created"
+
+        pairs[idx] = pair
+
+    # updates of existing rules go out as one executemany
+    db.flush()
+
+    for r in insert_many(db, NotificationRule, list(new_rules.values())):
+        existing[(r.user_id, r.service_id)] = r
+
+    rules = {idx: existing[pair] for idx, pair in pairs.items()}
+
+    # ---- Per-item report (built before commit, which expires the ORM objects) ----
+    results = []
+    for idx in range(len(items)):
+        if idx in errors:
+            results.append(RuleBulkItemOut(index=idx, status="error", detail=errors[idx]))
+        else:
+            results.append(RuleBulkItemOut(index=idx, status=statuses[idx], rule=_rule_out(rules[idx])))
+
+    db.commit()
+
+    return RuleBulkOut(
+        created=sum(1 for st in statuses.values() if st == "created"),
+        updated=sum(1 for st in statuses.values() if st == "updated"),
+        failed=len(errors),
+        results=results,
+    )
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Any, Dict, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from pydantic import BaseModel, Field, EmailStr
 
 Severity = Literal["INFO", "WARN", "ERROR", "CRITICAL"]
@@ -11,6 +11,8 @@ class ErrorIn(BaseModel):
     severity: Optional[Severity] = "ERROR"
     timestamp: Optional[datetime] = None
     context: Optional[Dict[str, Any]] = None
+    # Client generated id, used as idempotency key when no Idempotency-Key header is sent
+    event_id: Optional[str] = Field(None, min_length=1, max_length=200)
 
 
 class ErrorOut(BaseModel):
@@ -20,6 +22,38 @@ class ErrorOut(BaseModel):
     message: str
     severity: str
 
+# 202 body when the DB is unavailable and the event went to the local spool
+class ErrorAcceptedOut(BaseModel):
+    status: Literal["accepted"] = "accepted"
+    idempotency_key: str
+
+class TopItemOut(BaseModel):
+    key: str
+    count: int  # count-min estimate, never below the true count
+
+class AckIn(BaseModel):
+    acknowledged_by: Optional[str] = Field(None, min_length=1, max_length=255)
+
+class AckOut(BaseModel):
+    error_id: int
+    acknowledged_at: datetime
+    acknowledged_by: Optional[str] = None
+    cancelled_escalations: int  # pending calls dropped by this acknowledgement
+
+class ArchiveRunOut(BaseModel):
+    segments_written: int
+    rows_archived: int
+
+class ArchiveSegmentOut(BaseModel):
+    file: str
+    rows: int
+    id_min: int
+    id_max: int
+    created_from: datetime
+    created_to: datetime
+    machine_min: str
+    machine_max: str
+
 class UserIn(BaseModel):
     first_name: str = Field(..., min_length=1, max_length=100)
     last_name: str = Field(..., min_length=1, max_length=100)
@@ -68,6 +102,13 @@ class RuleIn(BaseModel):
     do_call: bool = False
     do_halo_ticket: bool = False
 
+    # 0 = notify per error; otherwise one digest per (user, channel) per window
+    digest_window_seconds: int = Field(0, ge=0, le=86400)
+    digest_bypass_critical: bool = True
+
+    # 0 = call right away; otherwise email/halo now and call only if not acknowledged in time
+    escalate_after_minutes: int = Field(0, ge=0, le=10080)
+
 
 class RuleOut(BaseModel):
     id: int
@@ -82,6 +123,71 @@ class RuleOut(BaseModel):
     do_call: bool
     do_halo_ticket: bool
 
+    digest_window_seconds: int = 0
+    digest_bypass_critical: bool = True
+    escalate_after_minutes: int = 0
+
+
+class PatternRuleIn(BaseModel):
+    user_id: int
+
+    # Either a Service.group OR a pattern on the machine name
+    target_group: Optional[str] = Field(None, min_length=1, max_length=100)
+    machine_pattern: Optional[str] = Field(None, min_length=1, max_length=200)
+    pattern_type: Literal["glob", "regex"] = "glob"
+
+    min_severity: Severity = "ERROR"
+
+    enabled: bool = True
+    do_email: bool = False
+    do_call: bool = False
+    do_halo_ticket: bool = False
+
+    # 0 = notify per error; otherwise one digest per (user, channel) per window
+    digest_window_seconds: int = Field(0, ge=0, le=86400)
+    digest_bypass_critical: bool = True
+
+    # 0 = call right away; otherwise email/halo now and call only if not acknowledged in time
+    escalate_after_minutes: int = Field(0, ge=0, le=10080)
+
+
+class PatternRuleOut(BaseModel):
+    id: int
+    created_at: datetime
+
+    user_id: int
+    target_group: Optional[str] = None
+    machine_pattern: Optional[str] = None
+    pattern_type: str
+    min_severity: str
+
+    enabled: bool
+    do_email: bool
+    do_call: bool
+    do_halo_ticket: bool
+
+    digest_window_seconds: int = 0
+    digest_bypass_critical: bool = True
+    escalate_after_minutes: int = 0
+
+
+class RuleBulkIn(BaseModel):
+    rules: List[RuleIn] = Field(..., min_length=1, max_length=5000)
+
+
+class RuleBulkItemOut(BaseModel):
+    index: int  # position in RuleBulkIn.rules
+    status: Literal["created", "updated", "error"]
+    rule: Optional[RuleOut] = None
+    detail: Optional[str] = None
+
+
+class RuleBulkOut(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    results: List[RuleBulkItemOut]
+
 class RuleUserOut(BaseModel):
     user_id: int
     first_name: str
@@ -91,6 +197,7 @@ class RuleUserOut(BaseModel):
 
     # rule data
     rule_id: int
+    rule_kind: Literal["service", "group", "pattern"] = "service"  # rule_id refers to /rules or /rules/patterns
     enabled: bool
     min_severity: str
     do_email: bool
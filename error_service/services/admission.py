@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Callable
+
+from starlette.responses import JSONResponse
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+# INFO/WARN may only fill this share of the queue, the rest is kept for ERROR/CRITICAL
+ADMISSION_LOW_QUEUE_SHARE = float(os.getenv("ADMISSION_LOW_QUEUE_SHARE", "0.5"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+HIGH = "high"  # ERROR / CRITICAL
+LOW = "low"  # INFO / WARN
+
+
+class AdmissionController:
+    """
+    Bounded in-flight limit with a bounded two-lane wait queue.
+
+    - A freed slot goes to the oldest HIGH waiter, then the oldest LOW waiter
+    - LOW is rejected once it holds its share of the queue
+    - When the queue is full, a HIGH arrival sheds the newest LOW waiter
+      instead of being rejected
+
+    Runs on the event loop only, so no locking.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 low_queue_share: float = ADMISSION_LOW_QUEUE_SHARE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_low_queue = int(max_queue * low_queue_share)
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self._waiters: dict[str, deque] = {HIGH: deque(), LOW: deque()}
+
+        self.admitted = {HIGH: 0, LOW: 0}
+        self.rejected = {HIGH: 0, LOW: 0}
+        self.timed_out = {HIGH: 0, LOW: 0}
+        self.shed = 0
+        self.peak_queue = 0
+
+    def queued(self) -> int:
+        return len(self._waiters[HIGH]) + len(self._waiters[LOW])
+
+    def _reject(self, lane: str) -> bool:
+        self.rejected[lane] += 1
+        return False
+
+    async def acquire(self, lane: str) -> bool:
+        high, low = self._waiters[HIGH], self._waiters[LOW]
+
+        if self.in_flight < self.max_in_flight and not high and (lane == HIGH or not low):
+            self.in_flight += 1
+            self.admitted[lane] += 1
+            return True
+
+        # ---- Queue or shed ----
+        if lane == LOW and len(low) >= self.max_low_queue:
+            return self._reject(lane)
+
+        if self.queued() >= self.max_queue:
+            if lane == LOW or not low:
+                return self._reject(lane)
+            victim = low.pop()
+            if not victim.done():
+                victim.set_result(False)
+            self.shed += 1
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(fut)
+        self.peak_queue = max(self.peak_queue, self.queued())
+
+        try:
+            ok = await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled() and fut.result():
+                # slot was handed over just as we gave up
+                if isinstance(e, asyncio.CancelledError):
+                    self.release()
+                    raise
+                ok = True
+            else:
+                fut.cancel()
+                try:
+                    self._waiters[lane].remove(fut)
+                except ValueError:
+                    pass
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.timed_out[lane] += 1
+                return False
+
+        if not ok:
+            self.rejected[lane] += 1  # shed from the queue
+            return False
+
+        self.admitted[lane] += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        for lane in (HIGH, LOW):
+            waiters = self._waiters[lane]
+            while waiters:
+                fut = waiters.popleft()
+                if fut.done():
+                    continue
+                self.in_flight += 1
+                fut.set_result(True)
+                return
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued_high": len(self._waiters[HIGH]),
+            "queued_low": len(self._waiters[LOW]),
+            "max_queue": self.max_queue,
+            "max_low_queue": self.max_low_queue,
+            "peak_queue": self.peak_queue,
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "timed_out": dict(self.timed_out),
+            "shed_low_for_high": self.shed,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware guarding POST /errors. Reads the (small) JSON body to find
+    the severity lane, waits for a slot, and replays the body downstream.
+    Sheds with 429 + Retry-After instead of letting requests pile up.
+    """
+
+    def __init__(self, app, controller: AdmissionController, sev_rank: Callable[[str | None], int],
+                 path: str = "/errors", high_rank: int = 30):
+        self.app = app
+        self.controller = controller
+        self.sev_rank = sev_rank
+        self.path = path
+        self.high_rank = high_rank
+
+    def _lane(self, body: bytes) -> str:
+        # a missing severity defaults to ERROR (like ErrorIn); a body that will
+        # fail validation with 422 must not jump the queue
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return LOW
+        if not isinstance(payload, dict):
+            return LOW
+        severity = payload.get("severity")
+        if severity is not None and not isinstance(severity, str):
+            return LOW
+        return HIGH if self.sev_rank(severity) >= self.high_rank else LOW
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        # ---- Buffer the body to read the severity ----
+        chunks, more = [], True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        lane = self._lane(body)
+
+        if not await self.controller.acquire(lane):
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Ingest overloaded, retry later."},
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            await self.app(scope, replay_receive, send)
+        finally:
+            self.controller.release()
@@ -0,0 +1,333 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from ..models import ErrorAcknowledgement, ErrorIdempotencyKey, ErrorRecord
+from ..schemas import ErrorOut
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", "50000"))
+
+# Footers list the distinct machines when there are at most this many, else only min/max
+FOOTER_MACHINE_SET_MAX = 256
+
+_MAGIC = b"ERRSEG1\n"
+_TRAILER = struct.Struct("<I4s")  # footer length, footer magic
+_TRAILER_MAGIC = b"SEGF"
+_DELETE_CHUNK = 500
+
+# created_at round-trips through a float epoch in segments
+_EPOCH_TOLERANCE = 2e-6
+
+
+def _to_epoch(dt: datetime) -> float:
+    # created_at is naive UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def from_epoch(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+# ---- Column encodings ----
+def _encode_numbers(typecode: str, values: list) -> bytes:
+    return zlib.compress(array(typecode, values).tobytes())
+
+
+def _decode_numbers(typecode: str, blob: bytes) -> array:
+    a = array(typecode)
+    a.frombytes(zlib.decompress(blob))
+    return a
+
+
+def _encode_strings(values: list[str]) -> bytes:
+    """Offsets (u32) + utf-8 blob, compressed together."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = array("I", [0])
+    for e in encoded:
+        offsets.append(offsets[-1] + len(e))
+    head = struct.pack("<I", len(offsets))
+    return zlib.compress(head + offsets.tobytes() + b"".join(encoded))
+
+
+def _decode_strings(blob: bytes) -> list[str]:
+    raw = zlib.decompress(blob)
+    (n,) = struct.unpack_from("<I", raw, 0)
+    offsets = array("I")
+    offsets.frombytes(raw[4:4 + 4 * n])
+    data = memoryview(raw)[4 + 4 * n:]
+    return [bytes(data[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(n - 1)]
+
+
+def _encode_dict(values: list[str]) -> bytes:
+    """Dictionary encoding for low-cardinality columns (machine, severity)."""
+    words = sorted(set(values))
+    index = {w: i for i, w in enumerate(words)}
+    codes = array("I", [index[v] for v in values])
+    head = json.dumps(words).encode("utf-8")
+    return zlib.compress(struct.pack("<I", len(head)) + head + codes.tobytes())
+
+
+def _decode_dict(blob: bytes) -> list[str]:
+    raw = zlib.decompress(blob)
+    (n,) = struct.unpack_from("<I", raw, 0)
+    words = json.loads(raw[4:4 + n])
+    codes = array("I")
+    codes.frombytes(raw[4 + n:])
+    return [words[c] for c in codes]
+
+
+_COLUMNS = {
+    # name: (encode, decode)
+    "id": (lambda v: _encode_numbers("q", v), lambda b: _decode_numbers("q", b)),
+    "created_at": (lambda v: _encode_numbers("d", v), lambda b: _decode_numbers("d", b)),
+    "machine": (_encode_dict, _decode_dict),
+    "severity": (_encode_dict, _decode_dict),
+    "message": (_encode_strings, _decode_strings),
+    "raw_payload": (_encode_strings, _decode_strings),
+}
+
+
+class Segment:
+    """
+    One compressed, column-oriented file of archived errors:
+
+        magic | column blobs ... | footer json | u32 footer length | "SEGF"
+
+    The footer holds row count, id/time/severity min-max, the machine range
+    (and set, when small) and the offset of every column, so a query can
+    skip the file after reading only its tail.
+    """
+
+    def __init__(self, path: str, footer: dict):
+        self.path = path
+        self.footer = footer
+
+    @classmethod
+    def open(cls, path: str) -> "Segment":
+        with open(path, "rb") as f:
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            length, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic != _TRAILER_MAGIC:
+                raise ValueError(f"Not an archive segment: {path}")
+            f.seek(-(_TRAILER.size + length), os.SEEK_END)
+            footer = json.loads(f.read(length))
+        return cls(path, footer)
+
+    @classmethod
+    def write(cls, path: str, rows: list[ErrorRecord], sev_rank: Callable[[str], int]) -> "Segment":
+        cols = {
+            "id": [r.id for r in rows],
+            "created_at": [_to_epoch(r.created_at) for r in rows],
+            "machine": [r.machine for r in rows],
+            "severity": [r.severity for r in rows],
+            "message": [r.message for r in rows],
+            "raw_payload": [r.raw_payload for r in rows],
+        }
+        machines = sorted(set(cols["machine"]))
+        ranks = [sev_rank(s) for s in set(cols["severity"])]
+
+        footer = {
+            "rows": len(rows),
+            "id_min": min(cols["id"]),
+            "id_max": max(cols["id"]),
+            "t_min": min(cols["created_at"]),
+            "t_max": max(cols["created_at"]),
+            "machine_min": machines[0],
+            "machine_max": machines[-1],
+            "machines": machines if len(machines) <= FOOTER_MACHINE_SET_MAX else None,
+            "sev_rank_min": min(ranks),
+            "sev_rank_max": max(ranks),
+            "columns": {},
+        }
+
+        # ids are reused on tables without AUTOINCREMENT, never clobber an archived segment
+        if os.path.exists(path):
+            raise FileExistsError(f"Archive segment already exists: {path}")
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            for name, (encode, _) in _COLUMNS.items():
+                blob = encode(cols[name])
+                footer["columns"][name] = [f.tell(), len(blob)]
+                f.write(blob)
+
+            head = json.dumps(footer, separators=(",", ":")).encode("utf-8")
+            f.write(head)
+            f.write(_TRAILER.pack(len(head), _TRAILER_MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # a segment is either complete or absent; link() fails instead of overwriting
+        try:
+            os.link(tmp, path)
+        finally:
+            os.unlink(tmp)
+        return cls(path, footer)
+
+    def may_contain(self, since: float | None, until: float | None,
+                    machine: str | None, min_rank: int | None) -> bool:
+        ft = self.footer
+        if since is not None and ft["t_max"] < since:
+            return False
+        if until is not None and ft["t_min"] > until:
+            return False
+        if machine is not None:
+            if not (ft["machine_min"] <= machine <= ft["machine_max"]):
+                return False
+            if ft["machines"] is not None and machine not in ft["machines"]:
+                return False
+        if min_rank is not None and ft["sev_rank_max"] < min_rank:
+            return False
+        return True
+
+    def read_columns(self, names: list[str]) -> dict:
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            out = {}
+            for name in names:
+                offset, length = self.footer["columns"][name]
+                out[name] = _COLUMNS[name][1](mm[offset:offset + length])
+            return out
+
+
+class Archive:
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self._segments: dict[str, Segment] = {}  # footer cache by file name
+
+    def segments(self) -> list[Segment]:
+        """All segments, oldest first (by newest row, ids alone are not monotonic after reuse)."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        names = [n for n in os.listdir(self.directory) if n.endswith(".seg")]
+        for n in names:
+            if n not in self._segments:
+                self._segments[n] = Segment.open(os.path.join(self.directory, n))
+        segs = [self._segments[n] for n in names]
+        segs.sort(key=lambda seg: (seg.footer["t_max"], seg.footer["id_max"], seg.path))
+        return segs
+
+    # ---- Archiving ----
+    def _delete_live(self, db: Session, ids: list[int]) -> None:
+        for i in range(0, len(ids), _DELETE_CHUNK):
+            chunk = ids[i:i + _DELETE_CHUNK]
+            db.query(ErrorIdempotencyKey).filter(ErrorIdempotencyKey.error_id.in_(chunk)).delete(synchronize_session=False)
+            db.query(ErrorAcknowledgement).filter(ErrorAcknowledgement.error_id.in_(chunk)).delete(synchronize_session=False)
+            db.query(ErrorRecord).filter(ErrorRecord.id.in_(chunk)).delete(synchronize_session=False)
+
+    def _reconcile(self, db: Session) -> None:
+        """
+        A crash between writing the newest segment and committing the delete
+        leaves rows in both places. Only rows matching the segment on
+        (id, created_at) are removed: ids can be reused by newer live errors.
+        """
+        segs = self.segments()
+        if not segs:
+            return
+        seg = segs[-1]
+        cols = seg.read_columns(["id", "created_at"])
+        archived = dict(zip(cols["id"], cols["created_at"]))
+        t_max = from_epoch(seg.footer["t_max"] + _EPOCH_TOLERANCE)
+
+        ids = list(archived)
+        dupes = []
+        for i in range(0, len(ids), _DELETE_CHUNK):
+            rows = (
+                db.query(ErrorRecord.id, ErrorRecord.created_at)
+                .filter(ErrorRecord.id.in_(ids[i:i + _DELETE_CHUNK]), ErrorRecord.created_at <= t_max)
+                .all()
+            )
+            dupes.extend(
+                error_id for error_id, created_at in rows
+                if abs(_to_epoch(created_at) - archived[error_id]) <= _EPOCH_TOLERANCE
+            )
+
+        if dupes:
+            self._delete_live(db, dupes)
+            db.commit()
+            print(f"[ARCHIVE] Removed {len(dupes)} live errors already in {os.path.basename(seg.path)}")
+
+    def run(self, db: Session, cutoff: datetime, sev_rank: Callable[[str], int]) -> dict:
+        """Move errors created before cutoff into segments of ARCHIVE_SEGMENT_ROWS, oldest first."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._reconcile(db)
+
+        written, archived = 0, 0
+        while True:
+            rows = (
+                db.query(ErrorRecord)
+                .filter(ErrorRecord.created_at < cutoff)
+                .order_by(ErrorRecord.id.asc())
+                .limit(ARCHIVE_SEGMENT_ROWS)
+                .all()
+            )
+            if not rows:
+                break
+
+            name = f"seg-{rows[0].id:012d}-{rows[-1].id:012d}.seg"
+            seg = Segment.write(os.path.join(self.directory, name), rows, sev_rank)
+            self._segments[name] = seg
+
+            self._delete_live(db, [r.id for r in rows])
+            db.commit()
+            db.expunge_all()
+
+            written += 1
+            archived += len(rows)
+            print(f"[ARCHIVE] {name}: {len(rows)} errors")
+
+        return {"segments_written": written, "rows_archived": archived}
+
+    # ---- Query ----
+    def query(self, since: datetime | None, until: datetime | None, machine: str | None,
+              min_rank: int | None, sev_rank: Callable[[str], int], limit: int) -> list[ErrorOut]:
+        """Newest first; only segments whose footer overlaps the filter are opened."""
+        since_ts = _to_epoch(since) if since else None
+        until_ts = _to_epoch(until) if until else None
+        machine = machine.strip().upper() if machine else None
+
+        out: list[ErrorOut] = []
+        for seg in reversed(self.segments()):
+            if len(out) >= limit:
+                break
+            if not seg.may_contain(since_ts, until_ts, machine, min_rank):
+                continue
+
+            cols = seg.read_columns(["id", "created_at", "machine", "severity"])
+            hits = [
+                i for i in range(seg.footer["rows"] - 1, -1, -1)
+                if (since_ts is None or cols["created_at"][i] >= since_ts)
+                and (until_ts is None or cols["created_at"][i] <= until_ts)
+                and (machine is None or cols["machine"][i] == machine)
+                and (min_rank is None or sev_rank(cols["severity"][i]) >= min_rank)
+            ][:limit - len(out)]
+            if not hits:
+                continue
+
+            messages = seg.read_columns(["message"])["message"]
+            out.extend(
+                ErrorOut(
+                    id=cols["id"][i],
+                    created_at=from_epoch(cols["created_at"][i]),
+                    machine=cols["machine"][i],
+                    message=messages[i],
+                    severity=cols["severity"][i],
+                )
+                for i in hits
+            )
+
+        return out
+
+
+archive = Archive()
@@ -0,0 +1,137 @@
+import heapq
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from threading import Condition, Thread
+from typing import Callable
+
+# Messages kept per digest for context, the counts cover everything else
+DIGEST_SAMPLE_SIZE = 5
+
+
+@dataclass
+class Digest:
+    user_id: int
+    channel: str  # email/halo/call
+    due_at: float
+    counts: Counter = field(default_factory=Counter)  # (machine, severity) -> count
+    samples: list = field(default_factory=list)  # (machine, severity, message, error_id)
+    total: int = 0
+    last_error_id: int = 0
+
+    @property
+    def machines(self) -> list[str]:
+        return sorted({m for (m, _) in self.counts})
+
+    def summary(self) -> str:
+        parts = [
+            f"{m} {sev} x{n}"
+            for (m, sev), n in sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        ]
+        return f"{self.total} errors: " + ", ".join(parts)
+
+
+class DigestBuffer:
+    """
+    Accumulates notifications per (user, channel) and flushes each bucket as
+    one call to `dispatch` when its window ends. The window starts with the
+    first error of the bucket. A single background thread sleeps until the
+    earliest deadline.
+    """
+
+    def __init__(self, dispatch: Callable[[Digest], None]):
+        self._dispatch = dispatch
+        self._buckets: dict[tuple[int, str], Digest] = {}
+        self._deadlines: list[tuple[float, tuple[int, str]]] = []
+        self._cond = Condition()
+        self._thread: Thread | None = None
+        self._stopping = False
+
+    def add(self, user_id: int, channel: str, window_seconds: int,
+            machine: str, severity: str, message: str, error_id: int) -> None:
+        key = (user_id, channel)
+
+        with self._cond:
+            # after stop() nothing would flush a bucket: send this one right away
+            stopped = self._stopping
+            d = None if stopped else self._buckets.get(key)
+            if d is None:
+                d = Digest(user_id=user_id, channel=channel, due_at=time.monotonic() + window_seconds)
+                if not stopped:
+                    self._buckets[key] = d
+                    heapq.heappush(self._deadlines, (d.due_at, key))
+                    self._cond.notify()
+
+            d.counts[(machine, severity)] += 1
+            d.total += 1
+            d.last_error_id = error_id
+            if len(d.samples) < DIGEST_SAMPLE_SIZE:
+                d.samples.append((machine, severity, message, error_id))
+
+        if stopped:
+            self._send([d])
+            return
+        self._ensure_thread()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._buckets)
+
+    def _pop_due(self, now: float) -> list[Digest]:
+        due = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, key = heapq.heappop(self._deadlines)
+            d = self._buckets.pop(key, None)
+            if d is not None:
+                due.append(d)
+        return due
+
+    def _send(self, digests: list[Digest]) -> None:
+        for d in digests:
+            try:
+                self._dispatch(d)
+            except Exception as e:  # keep the flusher alive
+                print(f"[DIGEST] dispatch failed user_id={d.user_id} channel={d.channel}: {e}")
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                timeout = None
+                if self._deadlines:
+                    timeout = max(0.0, self._deadlines[0][0] - time.monotonic())
+                self._cond.wait(timeout)
+                due = self._pop_due(time.monotonic())
+
+            self._send(due)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None and not self._stopping:
+                self._thread = Thread(target=self._run, name="digest-flusher", daemon=True)
+                self._thread.start()
+
+    def start(self) -> None:
+        with self._cond:
+            self._stopping = False
+        self._ensure_thread()
+
+    def stop(self) -> None:
+        """Stop the flusher and send whatever is still buffered."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            thread.join(timeout=5)
+
+        with self._cond:
+            remaining = list(self._buckets.values())
+            self._buckets.clear()
+            self._deadlines.clear()
+
+        self._send(remaining)
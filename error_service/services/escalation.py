@@ -0,0 +1,285 @@
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from ..models import PendingEscalation
+from ..repositories.bulk import insert_many
+
+ESCALATION_TICK_SECONDS = float(os.getenv("ESCALATION_TICK_SECONDS", "1"))
+
+# 5 levels of 64 slots: 64 ticks, ~68 min, ~3 days, ~194 days, ~34 years at 1s ticks
+WHEEL_BITS = 6
+WHEEL_SLOTS = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SLOTS - 1
+WHEEL_LEVELS = 5
+
+
+@dataclass
+class Timer:
+    id: int  # PendingEscalation.id
+    error_id: int
+    deadline: int  # tick
+    level: int = 0
+    slot: int = 0
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel (Varghese & Lauck). Level n covers 64**(n+1)
+    ticks; a timer sits in the lowest level whose current block contains its
+    deadline and cascades one level down when that block begins.
+
+    Slots are dicts keyed by timer id, so schedule and cancel are O(1);
+    advance() is O(1) per tick plus the timers it moves or fires.
+    Not thread-safe, the caller holds a lock.
+    """
+
+    def __init__(self, now: int):
+        self.current = now
+        self.slots: list[list[dict[int, Timer]]] = [[{} for _ in range(WHEEL_SLOTS)] for _ in range(WHEEL_LEVELS)]
+        self.timers: dict[int, Timer] = {}
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def _place(self, t: Timer) -> None:
+        # highest 6-bit group in which deadline and current differ
+        diff = t.deadline ^ self.current
+        level = min((diff.bit_length() - 1) // WHEEL_BITS, WHEEL_LEVELS - 1) if diff else 0
+        t.level = level
+        t.slot = (t.deadline >> (WHEEL_BITS * level)) & WHEEL_MASK
+        self.slots[level][t.slot][t.id] = t
+
+    def schedule(self, t: Timer) -> None:
+        # overdue timers (e.g. loaded after downtime) fire on the next tick
+        t.deadline = max(t.deadline, self.current + 1)
+        self.timers[t.id] = t
+        self._place(t)
+
+    def cancel(self, timer_id: int) -> Timer | None:
+        t = self.timers.pop(timer_id, None)
+        if t is not None:
+            del self.slots[t.level][t.slot][timer_id]
+        return t
+
+    def advance(self, now: int) -> list[Timer]:
+        """Move time forward to `now`, return the timers that expired."""
+        expired: list[Timer] = []
+        while self.current < now:
+            self.current += 1
+
+            # cascade the blocks starting at this tick, top level first
+            top = 0
+            while top + 1 < WHEEL_LEVELS and not self.current & ((1 << (WHEEL_BITS * (top + 1))) - 1):
+                top += 1
+            for level in range(top, 0, -1):
+                slot = self.slots[level][(self.current >> (WHEEL_BITS * level)) & WHEEL_MASK]
+                moving = list(slot.values())
+                slot.clear()
+                for t in moving:
+                    self._place(t)
+
+            slot = self.slots[0][self.current & WHEEL_MASK]
+            for t in slot.values():
+                del self.timers[t.id]
+                expired.append(t)
+            slot.clear()
+
+        return expired
+
+
+@dataclass
+class Escalation:
+    error_id: int
+    user_id: int
+    channel: str
+    delay_seconds: int
+    service_name: str
+    severity: str
+    message: str
+
+
+def _tick(ts: float) -> int:
+    return int(ts // ESCALATION_TICK_SECONDS)
+
+
+def _epoch(dt: datetime) -> float:
+    return (dt - datetime(1970, 1, 1)).total_seconds()  # due_at is naive UTC
+
+
+class EscalationScheduler:
+    """
+    Deferred actions (the call of an escalating rule) that fire only when the
+    error is not acknowledged before the deadline.
+
+    Every timer is a pending_escalations row; the in-memory wheel is rebuilt
+    from that table at start, so the errors table is never polled. Firing
+    deletes the row first and only dispatches if the delete hit, so an
+    acknowledgement (or another worker) that got there first wins.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], dispatch: Callable[[PendingEscalation], None]):
+        self.session_factory = session_factory
+        self.dispatch = dispatch
+        self._lock = Lock()
+        self._wheel = TimerWheel(_tick(time.time()))
+        self._by_error: dict[int, set[int]] = {}
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+
+    # ---- Wheel bookkeeping ----
+    def _add(self, timer_id: int, error_id: int, due_at: datetime) -> None:
+        with self._lock:
+            self._wheel.schedule(Timer(id=timer_id, error_id=error_id, deadline=_tick(_epoch(due_at))))
+            self._by_error.setdefault(error_id, set()).add(timer_id)
+
+    def _forget(self, t: Timer) -> None:
+        ids = self._by_error.get(t.error_id)
+        if ids is not None:
+            ids.discard(t.id)
+            if not ids:
+                del self._by_error[t.error_id]
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._wheel)
+
+    # ---- API ----
+    def stage(self, db: Session, items: list[Escalation]) -> list[tuple[int, int, datetime]]:
+        """
+        Write the escalation rows in the caller's transaction (the one storing
+        the error), so they commit or roll back with it. arm() the result once
+        that transaction has committed.
+        """
+        if not items:
+            return []
+        now = datetime.utcnow()
+        rows = insert_many(db, PendingEscalation, [
+            dict(
+                due_at=now + timedelta(seconds=it.delay_seconds),
+                error_id=it.error_id,
+                user_id=it.user_id,
+                channel=it.channel,
+                service_name=it.service_name[:150],
+                severity=it.severity,
+                message=it.message[:2000],
+            )
+            for it in items
+        ])
+        return [(r.id, r.error_id, r.due_at) for r in rows]
+
+    def arm(self, armed: list[tuple[int, int, datetime]]) -> None:
+        for timer_id, error_id, due_at in armed:
+            self._add(timer_id, error_id, due_at)
+        self.scheduled += len(armed)
+
+    def schedule(self, db: Session, items: list[Escalation]) -> None:
+        """Persist and arm the escalations of one error (one INSERT, one commit)."""
+        armed = self.stage(db, items)
+        if armed:
+            db.commit()
+            self.arm(armed)
+
+    def cancel_error(self, db: Session, error_id: int) -> int:
+        """Drop every pending escalation of an error; the caller commits."""
+        n = db.query(PendingEscalation).filter(PendingEscalation.error_id == error_id).delete(synchronize_session=False)
+
+        with self._lock:
+            for timer_id in self._by_error.pop(error_id, ()):
+                self._wheel.cancel(timer_id)
+
+        self.cancelled += n
+        return n
+
+    def clear(self) -> None:
+        with self._lock:
+            self._wheel = TimerWheel(_tick(time.time()))
+            self._by_error.clear()
+
+    def metrics(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "scheduled": self.scheduled,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+        }
+
+    # ---- Lifecycle ----
+    def load(self) -> int:
+        db = self.session_factory()
+        try:
+            rows = db.query(PendingEscalation.id, PendingEscalation.error_id, PendingEscalation.due_at).all()
+        finally:
+            db.close()
+
+        self.clear()
+        for timer_id, error_id, due_at in rows:
+            self._add(timer_id, error_id, due_at)
+        return len(rows)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        n = self.load()
+        if n:
+            print(f"[ESCALATION] Loaded {n} pending escalations")
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="escalation-wheel", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # pending rows stay in the table and are re-armed on the next start
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(ESCALATION_TICK_SECONDS):
+            with self._lock:
+                expired = self._wheel.advance(_tick(time.time()))
+                for t in expired:
+                    self._forget(t)
+            if expired:
+                self._fire(expired)
+
+    def _fire(self, expired: list[Timer]) -> None:
+        db = self.session_factory()
+        try:
+            for t in expired:
+                try:
+                    row = db.get(PendingEscalation, t.id)
+                    if row is None:
+                        continue  # acknowledged or fired elsewhere
+                    db.expunge(row)
+                    claimed = db.query(PendingEscalation).filter(PendingEscalation.id == t.id).delete(synchronize_session=False)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    print(f"[ESCALATION] Could not claim escalation {t.id} (error_id={t.error_id}), retrying: {e}")
+                    with self._lock:
+                        t.deadline = self._wheel.current + 1
+                        self._wheel.schedule(t)
+                        self._by_error.setdefault(t.error_id, set()).add(t.id)
+                    continue
+
+                if not claimed:
+                    continue
+
+                self.fired += 1
+                print(f"[ESCALATION] error_id={row.error_id} not acknowledged, escalating to {row.channel} user_id={row.user_id}")
+                try:
+                    self.dispatch(row)
+                except Exception as e:
+                    print(f"[ESCALATION] dispatch failed error_id={row.error_id} user_id={row.user_id}: {e}")
+        finally:
+            db.close()
@@ -0,0 +1,329 @@
+import base64
+import calendar
+import hashlib
+import heapq
+import json
+import os
+import time
+import zlib
+from array import array
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Callable, Iterable
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models import ErrorRecord
+
+HH_STATE_PATH = os.getenv("HH_STATE_PATH", "./heavy_hitters.state")
+HH_WINDOW_SECONDS = int(os.getenv("HH_WINDOW_SECONDS", "3600"))
+HH_WINDOWS = int(os.getenv("HH_WINDOWS", "24"))
+HH_TOP_K = int(os.getenv("HH_TOP_K", "50"))
+HH_PERSIST_INTERVAL_SECONDS = float(os.getenv("HH_PERSIST_INTERVAL_SECONDS", "60"))
+
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+
+# Messages are tracked by their first characters only
+MESSAGE_KEY_LENGTH = 200
+
+DIMENSIONS = ("machine", "message")
+
+
+def _hashes(key: str) -> tuple[int, int]:
+    # stable across restarts, unlike hash()
+    d = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(d[:4], "little"), int.from_bytes(d[4:], "little") | 1
+
+
+def _pack(a: array) -> str:
+    return base64.b64encode(zlib.compress(a.tobytes())).decode("ascii")
+
+
+def _unpack(typecode: str, s: str) -> array:
+    a = array(typecode)
+    a.frombytes(zlib.decompress(base64.b64decode(s)))
+    return a
+
+
+class CountMinSketch:
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = array("I", [0]) * (width * depth)
+
+    def _cells(self, key: str) -> list[int]:
+        h1, h2 = _hashes(key)
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key: str, n: int = 1) -> int:
+        """Add n, return the new estimate."""
+        cells = self._cells(key)
+        t = self.table
+        for c in cells:
+            t[c] += n
+        return min(t[c] for c in cells)
+
+    def estimate(self, key: str) -> int:
+        t = self.table
+        return min(t[c] for c in self._cells(key))
+
+
+class TopK:
+    """
+    Candidates with the k largest estimates. Updates push onto a heap and stale
+    heap entries are skipped lazily, so each update is O(log k).
+    """
+
+    def __init__(self, k: int = HH_TOP_K):
+        self.k = k
+        self.counts: dict[str, int] = {}
+        self._heap: list[tuple[int, str]] = []
+
+    def offer(self, key: str, estimate: int) -> None:
+        if key in self.counts or len(self.counts) < self.k:
+            self.counts[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+        else:
+            self._drop_stale()
+            if estimate <= self._heap[0][0]:
+                return
+            _, evicted = heapq.heappop(self._heap)
+            del self.counts[evicted]
+            self.counts[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(v, k) for k, v in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _drop_stale(self) -> None:
+        while self._heap and self.counts.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+class Summary:
+    """Sketch + top-k for one dimension over one time span."""
+
+    def __init__(self, start: int = 0):
+        self.start = start
+        self.cms = CountMinSketch()
+        self.top = TopK()
+
+    def add(self, key: str) -> None:
+        self.top.offer(key, self.cms.add(key))
+
+    def to_dict(self) -> dict:
+        return {"start": self.start, "cms": _pack(self.cms.table), "top": dict(self.top.counts)}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Summary":
+        s = cls(d["start"])
+        s.cms.table = _unpack("I", d["cms"])
+        for key, n in d["top"].items():
+            s.top.offer(key, n)
+        return s
+
+
+class HeavyHitters:
+    """
+    Fixed-memory streaming summary of the noisiest machines and messages.
+
+    Per dimension there is one all-time summary plus a ring of HH_WINDOWS
+    summaries of HH_WINDOW_SECONDS each. Every summary is a count-min sketch
+    with a top-k candidate set, so memory does not depend on how many
+    distinct machines or messages are seen. record() is O(depth + log k).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.dirty = False
+        self._reset()
+
+    def _reset(self) -> None:
+        self.total: dict[str, Summary] = {d: Summary() for d in DIMENSIONS}
+        self.windows: dict[str, list[Summary]] = {d: [] for d in DIMENSIONS}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+            self.dirty = True
+
+    @staticmethod
+    def _keys(machine: str, message: str) -> dict[str, str]:
+        return {"machine": machine, "message": message[:MESSAGE_KEY_LENGTH]}
+
+    def _window(self, dim: str, start: int) -> Summary | None:
+        ring = self.windows[dim]
+        for w in reversed(ring):
+            if w.start == start:
+                return w
+            if w.start < start:
+                break
+
+        newest = ring[-1].start if ring else None
+        if newest is not None and start < newest - (HH_WINDOWS - 1) * HH_WINDOW_SECONDS:
+            return None  # older than the retained windows
+        if newest is not None and start < newest:
+            # late event for a window that was never opened
+            w = Summary(start)
+            ring.append(w)
+            ring.sort(key=lambda s: s.start)
+            return w
+
+        w = Summary(start)
+        ring.append(w)
+        while len(ring) > HH_WINDOWS or (ring and ring[0].start <= start - HH_WINDOWS * HH_WINDOW_SECONDS):
+            ring.pop(0)
+        return w
+
+    def record(self, machine: str, message: str, created_at: datetime | None = None) -> None:
+        ts = calendar.timegm(created_at.utctimetuple()) if created_at else int(time.time())
+        start = ts - ts % HH_WINDOW_SECONDS
+
+        with self._lock:
+            for dim, key in self._keys(machine, message).items():
+                self.total[dim].add(key)
+                w = self._window(dim, start)
+                if w is not None:
+                    w.add(key)
+            self.dirty = True
+
+    def top(self, dim: str, n: int = 10, hours: int | None = None) -> list[tuple[str, int]]:
+        """Top n keys, all-time or over the windows covering the last `hours`."""
+        with self._lock:
+            if hours is None:
+                s = self.total[dim]
+                items = list(s.top.counts.items())
+            else:
+                since = int(time.time()) - hours * 3600
+                spans = [w for w in self.windows[dim] if w.start + HH_WINDOW_SECONDS > since]
+                candidates = {k for w in spans for k in w.top.counts}
+                items = [(k, sum(w.cms.estimate(k) for w in spans)) for k in candidates]
+
+        items.sort(key=lambda kv: (-kv[1], kv[0]))
+        return items[:n]
+
+    # ---- Persistence ----
+    def save(self, path: str = HH_STATE_PATH) -> None:
+        with self._lock:
+            state = {
+                "window_seconds": HH_WINDOW_SECONDS,
+                "total": {d: s.to_dict() for d, s in self.total.items()},
+                "windows": {d: [w.to_dict() for w in ring] for d, ring in self.windows.items()},
+            }
+            self.dirty = False
+
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def load(self, path: str = HH_STATE_PATH) -> bool:
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            total = {d: Summary.from_dict(s) for d, s in state["total"].items()}
+            windows = {d: [] for d in DIMENSIONS}
+            if state.get("window_seconds") == HH_WINDOW_SECONDS:
+                windows = {d: [Summary.from_dict(w) for w in ring] for d, ring in state["windows"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, zlib.error) as e:
+            # truncated or hand-edited; the caller rebuilds from the errors table
+            print(f"[STATS] Ignoring unreadable heavy hitters state {path}: {e!r}")
+            return False
+
+        with self._lock:
+            self._reset()
+            self.total.update(total)
+            self.windows.update(windows)
+        return True
+
+    def seed(self, rows: Iterable[tuple[str, str, datetime]]) -> int:
+        """One-time warm up from stored errors when there is no saved state."""
+        n = 0
+        for machine, message, created_at in rows:
+            self.record(machine, message, created_at)
+            n += 1
+        return n
+
+
+class Persister:
+    """Saves the summary every HH_PERSIST_INTERVAL_SECONDS when it changed, and on stop."""
+
+    def __init__(self, hh: HeavyHitters, path: str = HH_STATE_PATH):
+        self.hh = hh
+        self.path = path
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="heavy-hitters-persister", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(HH_PERSIST_INTERVAL_SECONDS):
+            self._save()
+
+    def _save(self) -> None:
+        if not self.hh.dirty:
+            return
+        try:
+            self.hh.save(self.path)
+        except OSError as e:
+            print(f"[STATS] Could not persist heavy hitters to {self.path}: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._save()
+
+
+heavy_hitters = HeavyHitters()
+persister = Persister(heavy_hitters)
+
+
+def _seed(session_factory: Callable[[], Session], max_id: int) -> None:
+    db = session_factory()
+    try:
+        rows = (
+            db.query(ErrorRecord.machine, ErrorRecord.message, ErrorRecord.created_at)
+            .filter(ErrorRecord.id <= max_id)
+            .yield_per(5000)
+        )
+        n = heavy_hitters.seed(rows)
+        print(f"[STATS] Seeded heavy hitters from {n} stored errors")
+    except Exception as e:
+        print(f"[STATS] Seeding heavy hitters failed: {e}")
+    finally:
+        db.close()
+
+
+def start(session_factory: Callable[[], Session]) -> None:
+    """
+    Load saved state, or seed once from the errors table in the background
+    (only rows that exist now; newer ones arrive through record()).
+    """
+    if not heavy_hitters.load():
+        db = session_factory()
+        try:
+            max_id = db.query(func.max(ErrorRecord.id)).scalar() or 0
+        finally:
+            db.close()
+        if max_id:
+            Thread(target=_seed, args=(session_factory, max_id), name="heavy-hitters-seed", daemon=True).start()
+
+    persister.start()
+
+
+def stop() -> None:
+    persister.stop()
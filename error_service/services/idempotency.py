@@ -0,0 +1,83 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy.orm import Session
+
+from ..models import ErrorIdempotencyKey, ErrorRecord
+from ..schemas import ErrorOut
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU of idempotency key -> ErrorOut.
+    Absorbs client retries without touching the DB; the unique index on
+    error_idempotency_keys is the source of truth once a key falls out.
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, ErrorOut]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> ErrorOut | None:
+        with self._lock:
+            out = self._items.get(key)
+            if out is not None:
+                self._items.move_to_end(key)
+            return out
+
+    def put(self, key: str, out: ErrorOut) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = out
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+idempotency_cache = IdempotencyCache()
+
+
+def normalize_key(header_key: str | None, event_id: str | None) -> str | None:
+    # Header wins over the payload field
+    key = (header_key or event_id or "").strip()
+    return key or None
+
+
+def find_error_by_key(db: Session, key: str) -> ErrorOut | None:
+    rec = (
+        db.query(ErrorRecord)
+        .join(ErrorIdempotencyKey, ErrorIdempotencyKey.error_id == ErrorRecord.id)
+        .filter(ErrorIdempotencyKey.key == key)
+        .first()
+    )
+    if not rec:
+        return None
+
+    return ErrorOut(
+        id=rec.id,
+        created_at=rec.created_at,
+        machine=rec.machine,
+        message=rec.message,
+        severity=rec.severity,
+    )
+
+
+def lookup(db: Session, key: str) -> ErrorOut | None:
+    """LRU first, then the unique index. Warms the LRU on a DB hit."""
+    out = idempotency_cache.get(key)
+    if out is not None:
+        return out
+
+    out = find_error_by_key(db, key)
+    if out is not None:
+        idempotency_cache.put(key, out)
+    return out
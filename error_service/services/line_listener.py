@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+import re
+import uuid
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from ..models import ErrorRecord
+from ..repositories.bulk import insert_many
+from ..schemas import ErrorOut
+from .spool import Spool, DB_UNAVAILABLE_ERRORS, finish_all, stage_all, to_record
+
+LINE_HOST = os.getenv("LINE_HOST", "0.0.0.0")
+LINE_TCP_PORT = int(os.getenv("LINE_TCP_PORT", "0"))  # 0 = disabled
+LINE_UDP_PORT = int(os.getenv("LINE_UDP_PORT", "0"))  # 0 = disabled
+LINE_BATCH_SIZE = int(os.getenv("LINE_BATCH_SIZE", "500"))
+LINE_BATCH_MAX_WAIT_MS = float(os.getenv("LINE_BATCH_MAX_WAIT_MS", "50"))
+LINE_QUEUE_SIZE = int(os.getenv("LINE_QUEUE_SIZE", "50000"))
+
+MAX_LINE_BYTES = 8192
+MACHINE_MAX_LENGTH = 50  # same limits as ErrorIn
+MESSAGE_MAX_LENGTH = 2000
+
+SEVERITIES = {"INFO", "WARN", "ERROR", "CRITICAL"}
+
+# optional syslog priority prefix, e.g. "<13>"
+_SYSLOG_PRI = re.compile(r"^<\d{1,3}>")
+
+
+def parse_line(line: str) -> tuple[str, str, str] | None:
+    """
+    "MACHINE SEVERITY message text" -> (MACHINE, SEVERITY, message).
+    SEVERITY may be left out (defaults to ERROR, like ErrorIn). None if malformed.
+    """
+    line = _SYSLOG_PRI.sub("", line.strip(), count=1)
+    parts = line.split(None, 2)
+    if len(parts) < 2:
+        return None
+
+    machine = parts[0].upper()
+    if len(machine) > MACHINE_MAX_LENGTH:
+        return None
+
+    if parts[1].upper() in SEVERITIES:
+        severity = parts[1].upper()
+        message = parts[2] if len(parts) > 2 else ""
+    else:
+        severity = "ERROR"
+        message = line.split(None, 1)[1]
+
+    message = message.strip()[:MESSAGE_MAX_LENGTH]
+    if not message:
+        return None
+    return machine, severity, message
+
+
+class LineListener:
+    """
+    asyncio TCP + UDP listener for a compact line format, feeding the same
+    ErrorRecord table and post-store pipeline (rules, stats) as POST /errors.
+
+    Parsed events go through a bounded queue to a single writer task, which
+    inserts them in batches of up to LINE_BATCH_SIZE (or whatever arrived
+    within LINE_BATCH_MAX_WAIT_MS) with one multi-row INSERT per batch.
+    TCP readers block on a full queue (backpressure via the socket), UDP drops.
+    If the DB is unavailable the batch goes to the spool.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session],
+                 on_insert: Callable[[ErrorOut, Session], Callable[[], None]], spool: Spool):
+        self.session_factory = session_factory
+        self.on_insert = on_insert
+        self.spool = spool
+
+        self.counters = {
+            "lines_received": 0,
+            "parsed": 0,
+            "malformed": 0,
+            "dropped_queue_full": 0,
+            "inserted": 0,
+            "spooled": 0,
+            "batches": 0,
+            "tcp_connections": 0,
+        }
+
+        self._queue: asyncio.Queue | None = None
+        self._tcp_server = None
+        self._clients: dict[asyncio.Task, asyncio.StreamWriter] = {}  # open TCP connections
+        self._udp_transport = None
+        self._writer_task: asyncio.Task | None = None
+
+    # ---- Lifecycle ----
+    async def start(self, host: str = LINE_HOST, tcp_port: int = LINE_TCP_PORT, udp_port: int = LINE_UDP_PORT) -> None:
+        if not tcp_port and not udp_port:
+            return
+
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=LINE_QUEUE_SIZE)
+        self._writer_task = asyncio.create_task(self._writer())
+
+        if tcp_port:
+            self._tcp_server = await asyncio.start_server(self._handle_tcp, host, tcp_port, limit=MAX_LINE_BYTES)
+            print(f"[LINES] TCP listening on {host}:{tcp_port}")
+
+        if udp_port:
+            self._udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UdpProtocol(self), local_addr=(host, udp_port)
+            )
+            print(f"[LINES] UDP listening on {host}:{udp_port}")
+
+    async def stop(self) -> None:
+        if self._tcp_server is not None:
+            self._tcp_server.close()
+            # senders keep connections open; since 3.12.1 wait_closed() waits for them
+            for writer in list(self._clients.values()):
+                writer.close()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._tcp_server.wait_closed()
+            self._tcp_server = None
+
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+            self._udp_transport = None
+
+        if self._writer_task is not None:
+            # let the writer drain what is queued, then stop it
+            await self._queue.join()
+            self._writer_task.cancel()
+            self._writer_task = None
+
+    def metrics(self) -> dict:
+        return {**self.counters, "queue_depth": self._queue.qsize() if self._queue else 0}
+
+    # ---- Input ----
+    def _parse(self, raw: str, source: str):
+        self.counters["lines_received"] += 1
+        parsed = parse_line(raw)
+        if parsed is None:
+            self.counters["malformed"] += 1
+            return None
+        self.counters["parsed"] += 1
+        return (*parsed, source, raw)
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.counters["tcp_connections"] += 1
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # line longer than MAX_LINE_BYTES; skip what was buffered
+                    self.counters["malformed"] += 1
+                    continue
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                event = self._parse(line.decode("utf-8", errors="replace"), "tcp")
+                if event is not None:
+                    await self._queue.put(event)
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.pop(task, None)
+            writer.close()
+
+    def _handle_datagram(self, data: bytes) -> None:
+        for raw in data.decode("utf-8", errors="replace").splitlines():
+            if not raw.strip():
+                continue
+            event = self._parse(raw, "udp")
+            if event is None:
+                continue
+            try:
+                self._queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.counters["dropped_queue_full"] += 1
+
+    # ---- Output ----
+    async def _writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + LINE_BATCH_MAX_WAIT_MS / 1000
+
+            while len(batch) < LINE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await asyncio.to_thread(self._store_batch, batch)
+            except Exception as e:
+                print(f"[LINES] Storing a batch of {len(batch)} failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _store_batch(self, batch: list[tuple]) -> None:
+        rows = [
+            dict(
+                machine=machine,
+                message=message,
+                severity=severity,
+                raw_payload=json.dumps(
+                    {"machine": machine, "message": message, "severity": severity, "source": source, "line": raw},
+                    ensure_ascii=False,
+                ),
+            )
+            for machine, severity, message, source, raw in batch
+        ]
+
+        db = self.session_factory()
+        try:
+            try:
+                recs = insert_many(db, ErrorRecord, rows)
+                outs = [
+                    ErrorOut(id=r.id, created_at=r.created_at, machine=r.machine, message=r.message, severity=r.severity)
+                    for r in recs
+                ]
+                after_commit = stage_all(sorted(outs, key=lambda o: o.id), db, self.on_insert, "[LINES]")
+                db.commit()
+            except DB_UNAVAILABLE_ERRORS:
+                db.rollback()
+                self.spool.append_many([
+                    to_record(f"spool:{uuid.uuid4().hex}", row["machine"], row["message"], row["severity"], row["raw_payload"])
+                    for row in rows
+                ])
+                self.counters["spooled"] += len(rows)
+                return
+
+            self.counters["batches"] += 1
+            self.counters["inserted"] += len(outs)
+            finish_all(after_commit, "[LINES]")
+        finally:
+            db.close()
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener: LineListener):
+        self.listener = listener
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.listener._handle_datagram(data)
@@ -0,0 +1,209 @@
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import os
+import pstats
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from threading import Lock
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Profiling is off unless an admin token is configured
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+PROFILE_ALL_REQUESTS = os.getenv("PROFILE_ALL_REQUESTS", "0") == "1"
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+# Warn when one request issues more SQL statements than this (0 = don't count)
+QUERY_COUNT_WARN = int(os.getenv("QUERY_COUNT_WARN", "20"))
+
+PROFILE_TOP_FUNCTIONS = 30
+PROFILE_MAX_STATEMENTS = 200
+
+
+class RequestStats:
+    def __init__(self, profile: bool):
+        self.queries = 0
+        self.profiler = cProfile.Profile() if profile else None
+        self.statements: list[tuple[str, float]] = []  # only filled when profiling
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+# ---- SQL capture ----
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    st = _current.get()
+    if st is None:
+        return
+    st.queries += 1
+    if st.profiler is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    st = _current.get()
+    if st is None or st.profiler is None:
+        return
+    started = conn.info.get("profile_started")
+    if started:
+        st.statements.append((statement, time.perf_counter() - started.pop()))
+
+
+# ---- Endpoint profiling ----
+class ProfiledRoute(APIRoute):
+    """
+    Runs the endpoint under cProfile when the current request is being profiled.
+    Wrapping the endpoint (not the middleware) matters: sync endpoints run in a
+    threadpool worker and cProfile only sees the thread it was enabled on.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def _profiled(endpoint):
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            st = _current.get()
+            if st is None or st.profiler is None:
+                return await endpoint(*args, **kwargs)
+            st.profiler.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                st.profiler.disable()
+        return wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        st = _current.get()
+        if st is None or st.profiler is None:
+            return endpoint(*args, **kwargs)
+        return st.profiler.runcall(endpoint, *args, **kwargs)
+    return wrapper
+
+
+# ---- Reports ----
+_reports: "OrderedDict[str, dict]" = OrderedDict()
+_reports_lock = Lock()
+
+
+def is_admin(request: Request) -> bool:
+    token = request.headers.get("X-Admin-Token")
+    return bool(PROFILE_ADMIN_TOKEN and token and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN))
+
+
+def _wants_profile(request: Request) -> bool:
+    if not PROFILE_ADMIN_TOKEN:
+        return False
+    if PROFILE_ALL_REQUESTS:
+        return True
+    return request.headers.get("X-Profile") == "1" and is_admin(request)
+
+
+def _build_report(request: Request, status: int, st: RequestStats, elapsed: float) -> dict:
+    buf = io.StringIO()
+    stats = pstats.Stats(st.profiler, stream=buf)
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+
+    # identical statements issued many times are the N+1 candidates
+    per_statement = Counter()
+    time_per_statement = Counter()
+    for sql, took in st.statements:
+        per_statement[sql] += 1
+        time_per_statement[sql] += took
+
+    return {
+        "id": uuid.uuid4().hex,
+        "method": request.method,
+        "path": request.url.path,
+        "status": status,
+        "duration_ms": round(elapsed * 1000, 3),
+        "query_count": st.queries,
+        "query_time_ms": round(sum(took for _, took in st.statements) * 1000, 3),
+        "statements_by_count": [
+            {"sql": sql, "count": n, "total_ms": round(time_per_statement[sql] * 1000, 3)}
+            for sql, n in per_statement.most_common()
+        ],
+        "statements": [
+            {"sql": sql, "ms": round(took * 1000, 3)}
+            for sql, took in st.statements[:PROFILE_MAX_STATEMENTS]
+        ],
+        "profile": buf.getvalue(),
+    }
+
+
+def _store(report: dict) -> None:
+    with _reports_lock:
+        _reports[report["id"]] = report
+        while len(_reports) > PROFILE_KEEP:
+            _reports.popitem(last=False)
+
+
+def get_report(report_id: str) -> dict | None:
+    with _reports_lock:
+        return _reports.get(report_id)
+
+
+def list_reports() -> list[dict]:
+    with _reports_lock:
+        return [
+            {k: r[k] for k in ("id", "method", "path", "status", "duration_ms", "query_count", "query_time_ms")}
+            for r in reversed(_reports.values())
+        ]
+
+
+class ProfilingMiddleware:
+    """
+    Plain ASGI middleware (no extra task or stream per request, unlike
+    BaseHTTPMiddleware). Counts SQL statements per request and, when asked
+    for, profiles the endpoint and attaches X-Profile-Id / X-Query-Count.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        profile = _wants_profile(request)
+        if not profile and not QUERY_COUNT_WARN:
+            await self.app(scope, receive, send)
+            return
+
+        st = RequestStats(profile)
+        started = time.perf_counter()
+
+        async def send_with_report(message):
+            if profile and message["type"] == "http.response.start":
+                # the endpoint has returned, the report is complete
+                report = _build_report(request, message["status"], st, time.perf_counter() - started)
+                _store(report)
+                headers = MutableHeaders(scope=message)
+                headers["X-Profile-Id"] = report["id"]
+                headers["X-Query-Count"] = str(st.queries)
+            await send(message)
+
+        token = _current.set(st)
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            _current.reset(token)
+
+        if QUERY_COUNT_WARN and st.queries > QUERY_COUNT_WARN:
+            print(f"[PERF] WARNING {request.method} {request.url.path} issued {st.queries} SQL statements (> {QUERY_COUNT_WARN}), possible N+1")
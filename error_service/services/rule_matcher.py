@@ -0,0 +1,201 @@
+import fnmatch
+import os
+import re
+import time
+from dataclasses import dataclass
+from threading import Lock
+
+from sqlalchemy.orm import Session
+
+from ..models import Service, NotificationRule, NotificationPatternRule
+
+# Rebuild at least this often so rule changes made by other workers are picked up
+RULE_MATCHER_TTL_SECONDS = float(os.getenv("RULE_MATCHER_TTL_SECONDS", "30"))
+
+# Per-machine memo of match results, machines are a small, slowly growing set
+MATCH_CACHE_SIZE = 4096
+
+# Compiled glob/regex patterns, reused across rebuilds
+PATTERN_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class RuleTarget:
+    kind: str  # service/group/pattern
+    rule_id: int
+    user_id: int
+    min_severity: str
+    do_email: bool
+    do_call: bool
+    do_halo_ticket: bool
+    digest_window_seconds: int
+    digest_bypass_critical: bool
+    escalate_after_minutes: int
+
+
+def _target(kind: str, r) -> RuleTarget:
+    return RuleTarget(
+        kind=kind,
+        rule_id=r.id,
+        user_id=r.user_id,
+        min_severity=r.min_severity,
+        do_email=r.do_email,
+        do_call=r.do_call,
+        do_halo_ticket=r.do_halo_ticket,
+        digest_window_seconds=r.digest_window_seconds,
+        digest_bypass_critical=r.digest_bypass_critical,
+        escalate_after_minutes=r.escalate_after_minutes,
+    )
+
+
+_compiled: dict[tuple[str, str], re.Pattern] = {}
+
+
+def compile_pattern(pattern: str, pattern_type: str) -> re.Pattern:
+    """Glob or regex -> compiled regex, matched case-insensitive against the whole machine name."""
+    key = (pattern, pattern_type)
+    rx = _compiled.get(key)
+    if rx is not None:
+        return rx
+
+    if pattern_type == "glob":
+        rx = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+    else:
+        rx = re.compile(f"(?:{pattern})\\Z", re.IGNORECASE)
+
+    if len(_compiled) >= PATTERN_CACHE_SIZE:
+        _compiled.clear()
+    _compiled[key] = rx
+    return rx
+
+
+class RuleMatcher:
+    """
+    Immutable snapshot of all enabled rules, compiled for lookup by machine name:
+    - exact service name -> rules (hash)
+    - service name -> groups -> group rules (hash)
+    - glob/regex rules tried one by one (only on a memo miss)
+
+    Results are memoized per machine name, so the steady state is a dict lookup.
+    """
+
+    def __init__(self, services: list, rules: list, pattern_rules: list, generation: int = 0):
+        self.built_at = time.monotonic()
+        self.generation = generation
+
+        self._service_names: dict[str, str] = {}
+        self._groups: dict[str, set[str]] = {}
+        service_names_by_id: dict[int, str] = {}
+
+        for s in services:
+            key = s.name.strip().upper()
+            self._service_names.setdefault(key, s.name)
+            self._groups.setdefault(key, set()).add(s.group)
+            service_names_by_id[s.id] = key
+
+        self._by_name: dict[str, list[RuleTarget]] = {}
+        for r in rules:
+            key = service_names_by_id.get(r.service_id)
+            if key is not None:
+                self._by_name.setdefault(key, []).append(_target("service", r))
+
+        self._by_group: dict[str, list[RuleTarget]] = {}
+        self._patterns: list[tuple[re.Pattern, RuleTarget]] = []
+        for r in pattern_rules:
+            if r.target_group:
+                self._by_group.setdefault(r.target_group, []).append(_target("group", r))
+            elif r.machine_pattern:
+                try:
+                    rx = compile_pattern(r.machine_pattern, r.pattern_type)
+                except re.error:
+                    print(f"[RULES] Skipping pattern rule_id={r.id}, invalid {r.pattern_type} '{r.machine_pattern}'")
+                    continue
+                self._patterns.append((rx, _target("pattern", r)))
+
+        self._memo: dict[str, tuple[RuleTarget, ...]] = {}
+
+    def service_name(self, machine: str) -> str | None:
+        return self._service_names.get(machine.strip().upper())
+
+    def match(self, machine: str) -> tuple[RuleTarget, ...]:
+        key = machine.strip().upper()
+        hit = self._memo.get(key)
+        if hit is not None:
+            return hit
+
+        targets = list(self._by_name.get(key, ()))
+
+        for group in self._groups.get(key, ()):
+            targets.extend(self._by_group.get(group, ()))
+
+        targets.extend(t for rx, t in self._patterns if rx.match(key))
+
+        result = tuple(targets)
+        if len(self._memo) >= MATCH_CACHE_SIZE:
+            self._memo.clear()
+        self._memo[key] = result
+        return result
+
+
+_matcher: RuleMatcher | None = None
+_generation = 0
+_lock = Lock()
+
+
+def invalidate() -> None:
+    """Call after any change to services or rules."""
+    global _matcher, _generation
+    _generation += 1
+    _matcher = None
+
+
+def build_matcher(db: Session, generation: int = 0) -> RuleMatcher:
+    services = db.query(Service).all()
+    rules = (
+        db.query(NotificationRule)
+        .filter(NotificationRule.enabled == True)  # noqa: E712
+        .all()
+    )
+    pattern_rules = (
+        db.query(NotificationPatternRule)
+        .filter(NotificationPatternRule.enabled == True)  # noqa: E712
+        .all()
+    )
+    return RuleMatcher(services, rules, pattern_rules, generation)
+
+
+def _fresh(m: RuleMatcher | None) -> bool:
+    return m is not None and m.generation == _generation and time.monotonic() - m.built_at < RULE_MATCHER_TTL_SECONDS
+
+
+def _rebuild(db: Session) -> RuleMatcher:
+    # caller holds _lock
+    global _matcher
+    generation = _generation
+    m = build_matcher(db, generation)
+    # don't keep a snapshot that raced with invalidate()
+    if generation == _generation:
+        _matcher = m
+    return m
+
+
+def get_matcher(db: Session) -> RuleMatcher:
+    m = _matcher
+    if _fresh(m):
+        return m
+
+    if m is not None and m.generation == _generation:
+        # only the TTL ran out: one caller refreshes, the others keep using
+        # this snapshot meanwhile instead of queueing on the lock
+        if not _lock.acquire(blocking=False):
+            return m
+        try:
+            m = _matcher
+            return m if _fresh(m) else _rebuild(db)
+        finally:
+            _lock.release()
+
+    # none yet, or invalidate()d by a local rule change: wait for the new one
+    with _lock:
+        m = _matcher
+        return m if _fresh(m) else _rebuild(db)
@@ -0,0 +1,322 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+
+from ..models import ErrorIdempotencyKey, ErrorRecord
+from ..schemas import ErrorOut
+
+SPOOL_PATH = os.getenv("SPOOL_PATH", "./errors.spool")
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "1") == "1"
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))
+SPOOL_REPLAY_INTERVAL_SECONDS = float(os.getenv("SPOOL_REPLAY_INTERVAL_SECONDS", "2"))
+
+# Errors that mean "DB is locked / unreachable", as opposed to a bad request
+DB_UNAVAILABLE_ERRORS = (OperationalError, PoolTimeoutError)
+
+# length + crc32 of the payload, little endian
+_HEADER = struct.Struct("<II")
+
+
+class Spool:
+    """
+    Crash-safe append-only file of error events.
+
+    Record = [u32 length][u32 crc32][json payload]. A torn or corrupt tail left
+    by a crash is cut off when the spool is opened. Replay progress is kept in
+    a sidecar offset file, written atomically after each drained batch.
+
+    fsync is group-committed: while one caller fsyncs, later appends queue up
+    and are covered by the next single fsync.
+    """
+
+    def __init__(self, path: str = SPOOL_PATH, fsync: bool = SPOOL_FSYNC):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.fsync = fsync
+
+        self._write_lock = Lock()
+        self._sync_lock = Lock()
+        self._written = 0  # append calls so far
+        self._synced = 0  # append calls known to be on disk
+        self._fh = None
+
+    # ---- Open / recovery ----
+    def _open(self):
+        if self._fh is None:
+            self._recover()
+            self._fh = open(self.path, "ab", buffering=0)
+        return self._fh
+
+    def _recover(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        size = os.path.getsize(self.path)
+        offset = self.read_offset()
+        if offset > size:
+            # crash between truncate and offset reset during compaction
+            offset = 0
+            self._write_offset(0)
+
+        end = offset
+        for _, next_pos in self._iter_records(offset, None):
+            end = next_pos
+
+        if end < size:
+            print(f"[SPOOL] Truncating torn tail of {self.path}: {size - end} bytes")
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+    # ---- Append ----
+    @staticmethod
+    def _frame(record: dict) -> bytes:
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def append(self, record: dict) -> None:
+        self.append_many([record])
+
+    def append_many(self, records: list[dict]) -> None:
+        """Append a batch with one write and (at most) one fsync."""
+        if not records:
+            return
+        frames = b"".join(self._frame(r) for r in records)
+
+        with self._write_lock:
+            fh = self._open()
+            fh.write(frames)
+            self._written += 1
+            mine = self._written
+
+        if self.fsync:
+            self._sync(mine)
+
+    def _sync(self, mine: int) -> None:
+        with self._sync_lock:
+            if self._synced >= mine:
+                return  # covered by someone else's fsync
+            with self._write_lock:
+                target = self._written
+                fd = self._fh.fileno()
+            os.fsync(fd)
+            self._synced = target
+
+    # ---- Read side ----
+    def read_offset(self) -> int:
+        try:
+            with open(self.offset_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset: int) -> None:
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+
+    def pending_bytes(self) -> int:
+        try:
+            return max(0, os.path.getsize(self.path) - self.read_offset())
+        except FileNotFoundError:
+            return 0
+
+    def _iter_records(self, offset: int, limit: int | None):
+        """Yield (record, next_offset) from offset, stopping at the first incomplete/corrupt frame."""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size <= offset:
+            return
+
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            pos, n = offset, 0
+            while pos + _HEADER.size <= size and (limit is None or n < limit):
+                length, crc = _HEADER.unpack_from(mm, pos)
+                start, end = pos + _HEADER.size, pos + _HEADER.size + length
+                if end > size:
+                    return
+                payload = mm[start:end]
+                if zlib.crc32(payload) != crc:
+                    return
+                try:
+                    record = json.loads(payload)
+                except ValueError:
+                    return
+                pos, n = end, n + 1
+                yield record, pos
+
+    def read_batch(self, limit: int) -> tuple[list[dict], int]:
+        """Next records after the committed offset, and the offset just past them."""
+        with self._write_lock:
+            self._open()
+        offset = self.read_offset()
+        records, end = [], offset
+        for record, next_pos in self._iter_records(offset, limit):
+            records.append(record)
+            end = next_pos
+        return records, end
+
+    def commit(self, offset: int) -> None:
+        """Mark everything before offset as replayed; compact once fully drained."""
+        with self._write_lock:
+            if offset >= os.path.getsize(self.path):
+                self._fh.truncate(0)
+                os.fsync(self._fh.fileno())
+                offset = 0
+            self._write_offset(offset)
+
+
+def to_record(key: str, machine: str, message: str, severity: str, raw_payload: str) -> dict:
+    return {
+        "key": key,
+        "machine": machine,
+        "message": message,
+        "severity": severity,
+        "raw_payload": raw_payload,
+        "received_at": datetime.utcnow().isoformat(),
+    }
+
+
+def stage_all(outs: list[ErrorOut], db: Session, on_insert: Callable[[ErrorOut, Session], Callable[[], None]],
+                tag: str) -> list[tuple[int, Callable[[], None]]]:
+    """
+    Run the post-store hook of each new row before the batch commits; one
+    failing event loses its own handling, not the batch. A DB that went away
+    fails the whole batch, like the insert would.
+    """
+    staged = []
+    for out in outs:
+        try:
+            staged.append((out.id, on_insert(out, db)))
+        except DB_UNAVAILABLE_ERRORS:
+            raise
+        except Exception as e:
+            print(f"{tag} Post-store handling failed for error_id={out.id}: {e}")
+    return staged
+
+
+def finish_all(staged: list[tuple[int, Callable[[], None]]], tag: str) -> None:
+    # stored and committed: one failing notification must not skip the rest
+    for error_id, after_commit in staged:
+        try:
+            after_commit()
+        except Exception as e:
+            print(f"{tag} Post-store handling failed for error_id={error_id}: {e}")
+
+
+class SpoolReplayer:
+    """
+    Background thread draining the spool into ErrorRecord, in order and in
+    batches of SPOOL_REPLAY_BATCH per transaction.
+
+    Every spooled event carries an idempotency key, inserted with the error in
+    the same transaction, so a batch that was committed but whose offset was
+    not yet saved is skipped on the next pass: each event is stored exactly once.
+    """
+
+    def __init__(self, spool: Spool, session_factory: Callable[[], Session],
+                 on_insert: Callable[[ErrorOut, Session], Callable[[], None]]):
+        self.spool = spool
+        self.session_factory = session_factory
+        self.on_insert = on_insert
+
+        self.replayed = 0
+        self.skipped_duplicates = 0
+        self.last_error: str | None = None
+
+        self._wake = Event()
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="spool-replayer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                while self.spool.pending_bytes() > 0 and not self._stop.is_set():
+                    if not self.replay_once():
+                        break
+                self.last_error = None
+            except DB_UNAVAILABLE_ERRORS as e:
+                self.last_error = str(e.orig if hasattr(e, "orig") else e)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[SPOOL] Replay failed: {e}")
+
+            self._wake.wait(SPOOL_REPLAY_INTERVAL_SECONDS)
+            self._wake.clear()
+
+    def replay_once(self) -> int:
+        records, end = self.spool.read_batch(SPOOL_REPLAY_BATCH)
+        if not records:
+            return 0
+
+        db = self.session_factory()
+        try:
+            keys = [r["key"] for r in records]
+            done = {
+                k for (k,) in db.query(ErrorIdempotencyKey.key)
+                .filter(ErrorIdempotencyKey.key.in_(keys))
+                .all()
+            }
+
+            stored = []
+            for r in records:
+                if r["key"] in done:
+                    self.skipped_duplicates += 1
+                    continue
+                done.add(r["key"])
+
+                rec = ErrorRecord(
+                    created_at=datetime.fromisoformat(r["received_at"]),
+                    machine=r["machine"],
+                    message=r["message"],
+                    severity=r["severity"],
+                    raw_payload=r["raw_payload"],
+                )
+                db.add(rec)
+                stored.append((r["key"], rec))
+
+            db.flush()
+            db.add_all([ErrorIdempotencyKey(key=k, error_id=rec.id) for k, rec in stored])
+
+            # snapshot before commit expires the ORM objects
+            outs = [
+                ErrorOut(id=rec.id, created_at=rec.created_at, machine=rec.machine,
+                         message=rec.message, severity=rec.severity)
+                for _, rec in stored
+            ]
+            after_commit = stage_all(outs, db, self.on_insert, "[SPOOL]")
+            db.commit()
+
+            self.spool.commit(end)
+            self.replayed += len(stored)
+            finish_all(after_commit, "[SPOOL]")
+
+            return len(records)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+# error_service reads its config at import time: point everything at a scratch dir first
+_TMP = tempfile.mkdtemp(prefix="error_service_tests_")
+os.environ.setdefault("DB_URL", f"sqlite:///{_TMP}/test.db")
+os.environ.setdefault("SPOOL_PATH", f"{_TMP}/errors.spool")
+os.environ.setdefault("HH_STATE_PATH", f"{_TMP}/heavy_hitters.state")
+os.environ.setdefault("ARCHIVE_DIR", f"{_TMP}/archive")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from error_service.db import Base, SessionLocal, engine
+from error_service import models  # noqa: F401  (registers the tables)
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+        session.close()
+
+
+@pytest.fixture
+def client(db):
+    """The app with its lifespan running, on a clean database and clean in-memory state."""
+    from error_service import main
+    from error_service.services import idempotency, rule_matcher
+    from error_service.services.heavy_hitters import heavy_hitters
+
+    rule_matcher.invalidate()
+    idempotency.idempotency_cache.clear()
+    heavy_hitters.clear()
+    with TestClient(main.app) as c:
+        yield c
+    rule_matcher.invalidate()
+    idempotency.idempotency_cache.clear()
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+from error_service.services.admission import (
+    ADMISSION_RETRY_AFTER_SECONDS, HIGH, LOW, AdmissionController, AdmissionMiddleware,
+)
+
+
+@pytest.mark.parametrize("severity", [5, ["a"], {"x": 1}, True])
+def test_non_string_severity_is_a_validation_error(client, severity):
+    r = client.post("/errors", json={"machine": "m", "message": "x", "severity": severity})
+    assert r.status_code == 422
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b'"str"'])
+def test_unparseable_body_is_a_validation_error(client, body):
+    r = client.post("/errors", content=body, headers={"Content-Type": "application/json"})
+    assert r.status_code == 422
+
+
+def test_high_severity_is_admitted(client):
+    r = client.post("/errors", json={"machine": "m", "message": "x", "severity": "CRITICAL"})
+    assert r.status_code == 201
+
+
+# ---- Lanes ----
+@pytest.mark.parametrize("body, lane", [
+    (b'{"machine": "m", "message": "x"}', HIGH),  # defaults to ERROR
+    (b'{"machine": "m", "message": "x", "severity": null}', HIGH),
+    (b'{"machine": "m", "message": "x", "severity": "CRITICAL"}', HIGH),
+    (b'{"machine": "m", "message": "x", "severity": "WARN"}', LOW),
+    (b'{"machine": "m", "message": "x", "severity": 40}', LOW),
+    (b'{"machine": "m", "message": "x", "severity": ["CRITICAL"]}', LOW),
+    (b"not json", LOW),
+    (b'["CRITICAL"]', LOW),
+])
+def test_lane(body, lane):
+    from error_service.main import SEVERITY_RANK, _sev_rank
+
+    mw = AdmissionMiddleware(None, AdmissionController(), sev_rank=_sev_rank, high_rank=SEVERITY_RANK["ERROR"])
+    assert mw._lane(body) == lane
+
+
+# ---- AdmissionController ----
+def _run(scenario):
+    return asyncio.run(scenario())
+
+
+async def _queue(c: AdmissionController, lane: str) -> asyncio.Task:
+    task = asyncio.create_task(c.acquire(lane))
+    await asyncio.sleep(0)  # let it reach the queue
+    return task
+
+
+def test_freed_slot_goes_to_high_before_low():
+    async def scenario():
+        c = AdmissionController(max_in_flight=1, max_queue=10)
+        assert await c.acquire(LOW)
+
+        low = await _queue(c, LOW)
+        high = await _queue(c, HIGH)
+        assert c.queued() == 2
+
+        c.release()
+        assert await high
+        assert not low.done()
+
+        c.release()
+        assert await low
+        assert c.in_flight == 1
+
+    _run(scenario)
+
+
+def test_low_lane_is_limited_to_its_share_of_the_queue():
+    async def scenario():
+        c = AdmissionController(max_in_flight=1, max_queue=4, low_queue_share=0.5)
+        assert await c.acquire(HIGH)
+
+        waiting = [await _queue(c, LOW), await _queue(c, LOW)]
+        assert not await c.acquire(LOW)
+        assert c.rejected[LOW] == 1
+
+        # the rest of the queue is still open to HIGH
+        waiting.append(await _queue(c, HIGH))
+        assert c.queued() == 3
+
+        for _ in waiting:
+            c.release()
+        assert await asyncio.gather(*waiting) == [True, True, True]
+
+    _run(scenario)
+
+
+def test_high_arrival_sheds_the_newest_low_waiter():
+    async def scenario():
+        c = AdmissionController(max_in_flight=1, max_queue=2, low_queue_share=1.0)
+        assert await c.acquire(LOW)
+
+        older, newer = await _queue(c, LOW), await _queue(c, LOW)
+        high = await _queue(c, HIGH)
+
+        assert await newer is False
+        assert c.shed == 1
+        assert not older.done()
+
+        c.release()
+        assert await high
+        c.release()
+        assert await older
+
+        # a full queue of HIGH waiters rejects the next HIGH
+        c2 = AdmissionController(max_in_flight=1, max_queue=1)
+        assert await c2.acquire(HIGH)
+        queued = await _queue(c2, HIGH)
+        assert not await c2.acquire(HIGH)
+        assert c2.rejected[HIGH] == 1
+        c2.release()
+        assert await queued
+
+    _run(scenario)
+
+
+def test_waiter_times_out_and_leaves_the_queue():
+    async def scenario():
+        c = AdmissionController(max_in_flight=1, max_queue=10, queue_timeout=0.05)
+        assert await c.acquire(HIGH)
+
+        assert not await c.acquire(LOW)
+        assert c.timed_out[LOW] == 1
+        assert c.queued() == 0
+
+        # the slot is not handed to the waiter that gave up
+        c.release()
+        assert c.in_flight == 0
+
+    _run(scenario)
+
+
+def test_overload_answers_429_with_retry_after_and_cors(client, monkeypatch):
+    from error_service.main import admission
+
+    monkeypatch.setattr(admission, "max_in_flight", 0)
+    monkeypatch.setattr(admission, "max_queue", 0)
+    monkeypatch.setattr(admission, "max_low_queue", 0)
+
+    r = client.post(
+        "/errors",
+        json={"machine": "m", "message": "x", "severity": "CRITICAL"},
+        headers={"Origin": "http://localhost:4200"},
+    )
+    assert r.status_code == 429
+    assert r.headers["Retry-After"] == str(ADMISSION_RETRY_AFTER_SECONDS)
+    assert r.headers["Access-Control-Allow-Origin"] == "http://localhost:4200"
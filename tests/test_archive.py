@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from error_service.models import ErrorRecord
+from error_service.services.archive import Archive, Segment
+
+SEV_RANK = {"INFO": 10, "WARN": 20, "ERROR": 30, "CRITICAL": 40}.get
+
+
+def _add(db, created_at, machine="WEB01", **kw):
+    rec = ErrorRecord(created_at=created_at, machine=machine, message="boom", severity="ERROR", raw_payload="{}", **kw)
+    db.add(rec)
+    db.commit()
+    return rec.id
+
+
+def _live_ids(db):
+    return sorted(i for (i,) in db.query(ErrorRecord.id))
+
+
+def test_archive_then_new_inserts_then_archive_again_keeps_live_errors(db, tmp_path):
+    archive = Archive(str(tmp_path))
+    old = datetime.utcnow() - timedelta(days=400)
+    cutoff = datetime.utcnow() - timedelta(days=365)
+
+    for i in range(3):
+        _add(db, old + timedelta(seconds=i))
+    assert archive.run(db, cutoff, SEV_RANK)["rows_archived"] == 3
+    assert _live_ids(db) == []
+
+    # fresh errors never get the archived ids again
+    new_ids = [_add(db, datetime.utcnow()) for _ in range(3)]
+    assert min(new_ids) > 3
+
+    assert archive.run(db, cutoff, SEV_RANK)["rows_archived"] == 0
+    assert _live_ids(db) == new_ids
+
+
+def test_reconcile_ignores_reused_ids(db, tmp_path):
+    # databases created before AUTOINCREMENT hand out archived ids again
+    archive = Archive(str(tmp_path))
+    old = datetime.utcnow() - timedelta(days=400)
+    cutoff = datetime.utcnow() - timedelta(days=365)
+
+    ids = [_add(db, old + timedelta(seconds=i)) for i in range(3)]
+    archive.run(db, cutoff, SEV_RANK)
+
+    for error_id in ids:
+        _add(db, datetime.utcnow(), id=error_id)
+
+    archive.run(db, cutoff, SEV_RANK)
+    assert _live_ids(db) == ids
+
+
+def test_reconcile_removes_rows_left_by_a_crash(db, tmp_path):
+    archive = Archive(str(tmp_path))
+    old = datetime.utcnow() - timedelta(days=400)
+    cutoff = datetime.utcnow() - timedelta(days=365)
+
+    for i in range(3):
+        _add(db, old + timedelta(seconds=i))
+    rows = db.query(ErrorRecord).order_by(ErrorRecord.id).all()
+    # segment written, delete never committed
+    Segment.write(str(tmp_path / "seg-crash.seg"), rows, SEV_RANK)
+
+    archive.run(db, cutoff, SEV_RANK)
+    assert _live_ids(db) == []
+    assert sum(s.footer["rows"] for s in archive.segments()) == 3
+
+
+def test_existing_segment_is_never_overwritten(db, tmp_path):
+    archive = Archive(str(tmp_path))
+    old = datetime.utcnow() - timedelta(days=400)
+    cutoff = datetime.utcnow() - timedelta(days=365)
+
+    first = _add(db, old)
+    archive.run(db, cutoff, SEV_RANK)
+    seg_path = archive.segments()[0].path
+    before = open(seg_path, "rb").read()
+
+    _add(db, old + timedelta(seconds=5), id=first)
+    with pytest.raises(FileExistsError):
+        archive.run(db, cutoff, SEV_RANK)
+
+    assert open(seg_path, "rb").read() == before
+    assert _live_ids(db) == [first]
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from error_service.services.digest import DIGEST_SAMPLE_SIZE, DigestBuffer
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def buffer(sent):
+    b = DigestBuffer(dispatch=sent.append)
+    b.start()
+    yield b
+    b.stop()
+
+
+def _wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_window_flushes_one_digest_per_user_and_channel(buffer, sent):
+    for i in range(3):
+        buffer.add(1, "email", 0.2, "WEB01", "ERROR", f"boom {i}", i + 1)
+    buffer.add(1, "call", 0.2, "WEB01", "ERROR", "boom", 4)
+    buffer.add(2, "email", 0.2, "WEB01", "ERROR", "boom", 5)
+    assert buffer.pending() == 3
+    assert sent == []
+
+    _wait_for(lambda: len(sent) == 3)
+    assert buffer.pending() == 0
+    assert sorted((d.user_id, d.channel, d.total) for d in sent) == [(1, "call", 1), (1, "email", 3), (2, "email", 1)]
+
+    # the next error opens a new window
+    buffer.add(1, "email", 0.2, "WEB01", "ERROR", "again", 6)
+    _wait_for(lambda: len(sent) == 4)
+    assert sent[-1].total == 1
+
+
+def test_digest_counts_per_machine_and_severity(buffer, sent):
+    for machine, severity in [("WEB01", "ERROR"), ("WEB01", "ERROR"), ("WEB01", "CRITICAL"), ("DB01", "WARN")] * 2:
+        buffer.add(1, "email", 0.1, machine, severity, "boom", 1)
+
+    _wait_for(lambda: sent)
+    (d,) = sent
+    assert d.total == 8
+    assert d.counts == {("WEB01", "ERROR"): 4, ("WEB01", "CRITICAL"): 2, ("DB01", "WARN"): 2}
+    assert d.machines == ["DB01", "WEB01"]
+    assert d.summary() == "8 errors: WEB01 ERROR x4, DB01 WARN x2, WEB01 CRITICAL x2"
+    assert len(d.samples) == DIGEST_SAMPLE_SIZE
+
+
+def test_stop_flushes_what_is_buffered(buffer, sent):
+    buffer.add(1, "email", 3600, "WEB01", "ERROR", "boom", 1)
+    buffer.add(1, "email", 3600, "WEB01", "ERROR", "boom", 2)
+
+    buffer.stop()
+    assert [(d.user_id, d.total, d.last_error_id) for d in sent] == [(1, 2, 2)]
+    assert buffer.pending() == 0
+
+
+def test_add_after_stop_is_sent_immediately(buffer, sent):
+    buffer.stop()
+
+    buffer.add(1, "email", 3600, "WEB01", "ERROR", "late", 7)
+    assert [(d.user_id, d.total, d.last_error_id) for d in sent] == [(1, 1, 7)]
+    assert buffer.pending() == 0
+
+
+def test_critical_bypasses_the_digest_window(client, monkeypatch):
+    from error_service import main
+
+    emails = []
+    monkeypatch.setitem(main.ACTIONS, "email", lambda user_id, service, severity, message, error_id: emails.append((severity, message)))
+
+    user = client.post("/users", json={"first_name": "a", "last_name": "b", "role": "ops", "email": "a@x.io"}).json()["id"]
+    svc = client.post("/services", json={"name": "WEB01", "group": "web"}).json()["id"]
+    client.post("/rules", json={"user_id": user, "service_id": svc, "do_email": True, "digest_window_seconds": 3600})
+
+    client.post("/errors", json={"machine": "web01", "message": "slow", "severity": "ERROR"})
+    assert emails == []
+    assert main.digests.pending() == 1
+
+    client.post("/errors", json={"machine": "web01", "message": "down", "severity": "CRITICAL"})
+    assert emails == [("CRITICAL", "down")]
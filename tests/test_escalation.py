@@ -0,0 +1,258 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from error_service.db import SessionLocal, engine
+from error_service.models import ErrorRecord, PendingEscalation
+from error_service.services import escalation as esc
+from error_service.services.escalation import (
+    WHEEL_BITS, WHEEL_LEVELS, Escalation, EscalationScheduler, Timer, TimerWheel,
+)
+
+
+# ---- TimerWheel ----
+def _step_until_empty(w: TimerWheel, horizon: int) -> dict[int, int]:
+    """Advance one tick at a time, return timer id -> tick it fired on."""
+    fired = {}
+    for _ in range(horizon):
+        for t in w.advance(w.current + 1):
+            fired[t.id] = w.current
+        if not len(w):
+            break
+    return fired
+
+
+@pytest.mark.parametrize("level", range(1, WHEEL_LEVELS - 1))
+def test_timers_cascade_across_level_boundaries(level):
+    block = 1 << (WHEEL_BITS * level)
+    # just before a level boundary, so deadlines straddle it
+    start = 7 * block - 3
+    w = TimerWheel(start)
+    deadlines = {i: start + d for i, d in enumerate([1, 2, 3, 4, 5, block - 1, block, block + 1, 3 * block + 17])}
+    for i, d in deadlines.items():
+        w.schedule(Timer(i, i, d))
+
+    assert _step_until_empty(w, 4 * block) == deadlines
+
+
+def test_random_timers_fire_exactly_at_their_deadline():
+    rnd = random.Random(7)
+    start = rnd.randrange(1 << 30)
+    w = TimerWheel(start)
+    deadlines = {i: start + rnd.choice([rnd.randrange(1, 64), rnd.randrange(1, 5000), rnd.randrange(1, 20000)]) for i in range(3000)}
+    for i, d in deadlines.items():
+        w.schedule(Timer(i, i, d))
+
+    assert _step_until_empty(w, 20000) == deadlines
+
+
+def test_large_steps_fire_everything_due():
+    w = TimerWheel(1000)
+    for i, d in enumerate([1001, 1064, 5000, 300000]):
+        w.schedule(Timer(i, i, d))
+    assert sorted(t.id for t in w.advance(5000)) == [0, 1, 2]
+    assert [t.id for t in w.advance(300000)] == [3]
+
+
+def test_cancel():
+    w = TimerWheel(0)
+    for i, d in enumerate([10, 100, 10000]):
+        w.schedule(Timer(i, i, d))
+
+    assert w.cancel(1).id == 1
+    assert w.cancel(1) is None
+    assert len(w) == 2
+    assert sorted(t.id for t in w.advance(20000)) == [0, 2]
+
+
+def test_cancel_after_cascade():
+    w = TimerWheel(0)
+    w.schedule(Timer(1, 1, 200))
+    w.advance(150)  # moved from level 1 down to level 0
+    assert w.cancel(1) is not None
+    assert w.advance(1000) == []
+
+
+def test_overdue_timer_fires_on_next_tick():
+    w = TimerWheel(100)
+    w.schedule(Timer(1, 1, 5))
+    assert [t.id for t in w.advance(101)] == [1]
+
+
+# ---- EscalationScheduler ----
+@pytest.fixture
+def dispatched():
+    return []
+
+
+@pytest.fixture
+def scheduler(db, dispatched, monkeypatch):
+    monkeypatch.setattr(esc, "ESCALATION_TICK_SECONDS", 0.05)
+    s = EscalationScheduler(SessionLocal, dispatch=lambda p: dispatched.append((p.error_id, p.user_id, p.message)))
+    yield s
+    s.stop()
+
+
+def _escalation(error_id, delay=60):
+    return Escalation(error_id=error_id, user_id=1, channel="call", delay_seconds=delay,
+                      service_name="WEB01", severity="CRITICAL", message=f"error {error_id}")
+
+
+def _fire_due(s: EscalationScheduler, now: float):
+    with s._lock:
+        expired = s._wheel.advance(esc._tick(now))
+        for t in expired:
+            s._forget(t)
+    s._fire(expired)
+
+
+def test_schedule_persists_and_fires_once(db, scheduler, dispatched):
+    scheduler.schedule(db, [_escalation(1, delay=60)])
+    assert db.query(PendingEscalation).count() == 1
+
+    _fire_due(scheduler, time.time() + 30)
+    assert dispatched == []
+
+    _fire_due(scheduler, time.time() + 61)
+    assert dispatched == [(1, 1, "error 1")]
+    assert db.query(PendingEscalation).count() == 0
+    assert scheduler.pending() == 0
+
+
+def test_ack_cancels(db, scheduler, dispatched):
+    scheduler.schedule(db, [_escalation(1), _escalation(2)])
+
+    assert scheduler.cancel_error(db, 1) == 1
+    db.commit()
+
+    _fire_due(scheduler, time.time() + 61)
+    assert dispatched == [(2, 1, "error 2")]
+
+
+def test_overdue_rows_are_reloaded_and_fired_at_start(db, scheduler, dispatched):
+    # written by a previous run that stopped before the deadline
+    past = datetime.utcnow() - timedelta(minutes=10)
+    db.add_all([
+        PendingEscalation(due_at=past, error_id=1, user_id=1, channel="call", service_name="WEB01", severity="CRITICAL", message="error 1"),
+        PendingEscalation(due_at=past + timedelta(days=1), error_id=2, user_id=1, channel="call", service_name="WEB01", severity="CRITICAL", message="error 2"),
+    ])
+    db.commit()
+
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while not dispatched and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert dispatched == [(1, 1, "error 1")]
+    assert scheduler.pending() == 1
+
+
+def test_ack_elsewhere_before_fire_wins(db, scheduler, dispatched):
+    scheduler.schedule(db, [_escalation(1)])
+
+    # another worker acknowledged: the row is gone, this wheel still holds the timer
+    db.query(PendingEscalation).delete()
+    db.commit()
+
+    _fire_due(scheduler, time.time() + 61)
+    assert dispatched == []
+    assert scheduler.fired == 0
+
+
+def test_ack_racing_the_claim_wins(db, scheduler, dispatched):
+    scheduler.schedule(db, [_escalation(1)])
+
+    class AckRacesClaim(Session):
+        def get(self, *args, **kwargs):
+            row = super().get(*args, **kwargs)
+            # acknowledgement commits between loading the row and deleting it
+            other = SessionLocal()
+            other.query(PendingEscalation).delete()
+            other.commit()
+            other.close()
+            return row
+
+    scheduler.session_factory = lambda: AckRacesClaim(bind=engine)
+    _fire_due(scheduler, time.time() + 61)
+    assert dispatched == []
+
+
+def _escalating_rule(client):
+    user = client.post("/users", json={"first_name": "a", "last_name": "b", "role": "ops", "email": "a@x.io"}).json()["id"]
+    svc = client.post("/services", json={"name": "WEB01", "group": "web"}).json()["id"]
+    client.post("/rules", json={"user_id": user, "service_id": svc, "do_email": True, "do_call": True, "escalate_after_minutes": 5})
+
+
+def test_ack_endpoint_cancels_deferred_call(client):
+    _escalating_rule(client)
+
+    error_id = client.post("/errors", json={"machine": "web01", "message": "down", "severity": "CRITICAL"}).json()["id"]
+    assert client.get("/metrics/escalations").json()["pending"] == 1
+
+    ack = client.post(f"/errors/{error_id}/ack", json={"acknowledged_by": "ops@x.io"}).json()
+    assert ack["cancelled_escalations"] == 1
+    assert client.get("/metrics/escalations").json()["pending"] == 0
+
+    # acknowledging again is harmless
+    again = client.post(f"/errors/{error_id}/ack").json()
+    assert again["acknowledged_by"] == "ops@x.io"
+    assert again["cancelled_escalations"] == 0
+
+    assert client.post("/errors/999999/ack").status_code == 404
+
+
+def test_escalation_rows_commit_with_the_error(client, db):
+    from error_service import main
+    from error_service.db import get_db
+
+    _escalating_rule(client)
+
+    def locked_db():
+        s = SessionLocal()
+
+        def commit():
+            raise OperationalError("COMMIT", {}, Exception("database is locked"))
+
+        s.commit = commit
+        try:
+            yield s
+        finally:
+            s.close()
+
+    # the commit fails: neither the error nor its escalation is stored, the event is spooled
+    main.app.dependency_overrides[get_db] = locked_db
+    try:
+        r = client.post("/errors", json={"machine": "web01", "message": "down", "severity": "CRITICAL"})
+    finally:
+        del main.app.dependency_overrides[get_db]
+    assert r.status_code == 202
+    assert db.query(ErrorRecord).count() == 0
+    assert db.query(PendingEscalation).count() == 0
+
+    # the replayer stores both, once
+    deadline = time.monotonic() + 10
+    while main.spool_replayer.replayed == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert db.query(ErrorRecord).count() == 1
+    assert db.query(PendingEscalation).count() == 1
+    assert client.get("/metrics/escalations").json()["pending"] == 1
+
+
+def test_post_commit_failure_does_not_fail_the_request(client, db, monkeypatch):
+    from error_service import main
+
+    _escalating_rule(client)
+
+    def arm(armed):
+        raise RuntimeError("wheel broken")
+
+    monkeypatch.setattr(main.escalations, "arm", arm)
+    r = client.post("/errors", json={"machine": "web01", "message": "down", "severity": "CRITICAL"}, headers={"Idempotency-Key": "k1"})
+    assert r.status_code == 201
+
+    # the row committed with the error and is armed on the next start
+    assert db.query(PendingEscalation).filter(PendingEscalation.error_id == r.json()["id"]).count() == 1
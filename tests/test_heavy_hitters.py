@@ -0,0 +1,152 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from error_service.db import SessionLocal
+from error_service.models import ErrorRecord
+from error_service.services import heavy_hitters as hh
+from error_service.services.heavy_hitters import CountMinSketch, HeavyHitters, TopK
+
+
+def _at(ts: float) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)  # naive UTC, like created_at
+
+
+# ---- CountMinSketch ----
+def test_sketch_never_underestimates_and_stays_close():
+    cms = CountMinSketch(width=256, depth=4)
+    truth = {f"key{i}": i % 7 + 1 for i in range(500)}
+    for key, n in truth.items():
+        cms.add(key, n)
+
+    errors = [cms.estimate(k) - n for k, n in truth.items()]
+    assert min(errors) >= 0
+    # expected overcount per key is about total / width
+    assert sum(errors) / len(errors) < 2 * sum(truth.values()) / 256
+
+
+def test_sketch_add_returns_the_new_estimate():
+    cms = CountMinSketch()
+    assert cms.add("a") == 1
+    assert cms.add("a", 4) == 5
+    assert cms.estimate("a") == 5
+    assert cms.estimate("never seen") == 0
+
+
+# ---- TopK ----
+def test_topk_evicts_the_smallest_candidate():
+    top = TopK(k=3)
+    for key, n in [("a", 5), ("b", 1), ("c", 3)]:
+        top.offer(key, n)
+
+    top.offer("d", 1)  # not above the smallest: ignored
+    assert set(top.counts) == {"a", "b", "c"}
+
+    top.offer("d", 2)
+    assert top.counts == {"a": 5, "c": 3, "d": 2}
+
+    # a raised count of a member makes another key the smallest
+    top.offer("d", 9)
+    top.offer("e", 4)
+    assert top.counts == {"a": 5, "d": 9, "e": 4}
+
+
+def test_topk_heap_stays_bounded():
+    top = TopK(k=2)
+    for i in range(1000):
+        top.offer("hot", i)
+    assert len(top._heap) <= 4 * top.k + 1
+    assert top.counts == {"hot": 999}
+
+
+# ---- Windows ----
+@pytest.fixture
+def small_windows(monkeypatch):
+    monkeypatch.setattr(hh, "HH_WINDOW_SECONDS", 60)
+    monkeypatch.setattr(hh, "HH_WINDOWS", 3)
+
+
+def test_windows_roll_over_and_old_ones_drop_out(small_windows):
+    h = HeavyHitters()
+    now = time.time()
+
+    h.record("OLD", "x", _at(now - 10 * 60))
+    for _ in range(3):
+        h.record("HOT", "x", _at(now - 60))
+    h.record("NEW", "x", _at(now))
+
+    assert len(h.windows["machine"]) <= 3
+    assert dict(h.top("machine", hours=1)) == {"HOT": 3, "NEW": 1}
+    # all-time keeps everything
+    assert dict(h.top("machine")) == {"HOT": 3, "NEW": 1, "OLD": 1}
+
+    # a late event older than the retained windows only counts all-time
+    h.record("LATE", "x", _at(now - 30 * 60))
+    assert "LATE" not in dict(h.top("machine", hours=1))
+    assert dict(h.top("machine"))["LATE"] == 1
+
+
+def test_messages_are_keyed_by_their_prefix():
+    h = HeavyHitters()
+    h.record("M", "x" * hh.MESSAGE_KEY_LENGTH + "a")
+    h.record("M", "x" * hh.MESSAGE_KEY_LENGTH + "b")
+    assert h.top("message") == [("x" * hh.MESSAGE_KEY_LENGTH, 2)]
+
+
+# ---- Persistence ----
+def test_save_load_round_trip(tmp_path):
+    h = HeavyHitters()
+    now = time.time()
+    for i in range(20):
+        h.record(f"M{i % 4}", f"msg {i % 3}", _at(now - (i % 2) * hh.HH_WINDOW_SECONDS))
+
+    path = str(tmp_path / "hh.state")
+    h.save(path)
+
+    loaded = HeavyHitters()
+    assert loaded.load(path)
+    for dim in hh.DIMENSIONS:
+        assert loaded.top(dim) == h.top(dim)
+        assert loaded.top(dim, hours=2) == h.top(dim, hours=2)
+    assert loaded.total["machine"].cms.table == h.total["machine"].cms.table
+
+
+@pytest.mark.parametrize("content", ["{not json", '{"total": {"machine": {"start": 0}}}', '{"total": {"machine": {"start": 0, "cms": "AAAA", "top": {}}}}'])
+def test_unreadable_state_is_ignored(tmp_path, content):
+    path = tmp_path / "hh.state"
+    path.write_text(content)
+
+    h = HeavyHitters()
+    h.record("KEEP", "x")
+    assert not h.load(str(path))
+    assert dict(h.top("machine")) == {"KEEP": 1}
+
+
+def test_start_seeds_from_the_table_when_the_state_is_corrupt(db):
+    db.add_all([ErrorRecord(machine="SEEDED", message="boom", severity="ERROR", raw_payload="{}") for _ in range(3)])
+    db.commit()
+
+    with open(hh.HH_STATE_PATH, "w") as f:
+        f.write('{"total": ')
+    hh.heavy_hitters.clear()
+    try:
+        hh.start(SessionLocal)
+        deadline = time.monotonic() + 5
+        while not hh.heavy_hitters.top("machine") and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert hh.heavy_hitters.top("machine") == [("SEEDED", 3)]
+    finally:
+        hh.stop()
+        hh.heavy_hitters.clear()
+        os.remove(hh.HH_STATE_PATH)
+
+
+def test_stats_top_hours_is_bounded_by_the_retained_windows(client):
+    from error_service.main import TOP_MAX_HOURS
+
+    assert client.get("/stats/top", params={"hours": 1}).status_code == 200
+    assert client.get("/stats/top", params={"hours": TOP_MAX_HOURS}).status_code == 200
+    assert client.get("/stats/top", params={"hours": 0}).status_code == 422
+    assert client.get("/stats/top", params={"hours": TOP_MAX_HOURS + 1}).status_code == 422
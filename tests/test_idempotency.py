@@ -0,0 +1,112 @@
+import pytest
+
+from error_service.models import ErrorIdempotencyKey, ErrorRecord
+from error_service.services import idempotency
+from error_service.services.idempotency import IdempotencyCache, normalize_key
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Error ids whose rule actions ran (the step after the commit)."""
+    from error_service import main
+
+    calls = []
+    handle_error = main.handle_error
+
+    def counting(machine_name, severity, message, error_id, db):
+        notify = handle_error(machine_name, severity, message, error_id, db)
+
+        def counted():
+            calls.append(error_id)
+            notify()
+
+        return counted
+
+    monkeypatch.setattr(main, "handle_error", counting)
+    return calls
+
+
+def _post(client, key=None, **payload):
+    body = {"machine": "web01", "message": "boom", **payload}
+    return client.post("/errors", json=body, headers={"Idempotency-Key": key} if key else {})
+
+
+def test_normalize_key_prefers_the_header():
+    assert normalize_key(" h1 ", "e1") == "h1"
+    assert normalize_key(None, "e1") == "e1"
+    assert normalize_key("  ", None) is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = IdempotencyCache(maxsize=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+
+
+def test_header_retry_returns_the_original_and_is_handled_once(client, db, handled):
+    first = _post(client, "k1")
+    assert first.status_code == 201
+
+    # a retry, even with a changed body, is the same event
+    retry = _post(client, "k1", message="boom again")
+    assert retry.status_code == 201
+    assert retry.json() == first.json()
+
+    assert db.query(ErrorRecord).count() == 1
+    assert handled == [first.json()["id"]]
+
+
+def test_event_id_is_the_key_without_a_header(client, db, handled):
+    first = _post(client, event_id="e1")
+    assert _post(client, event_id="e1").json()["id"] == first.json()["id"]
+
+    # the header wins, so this does not register e1 a second time
+    other = _post(client, "h1", event_id="e1")
+    assert other.json()["id"] != first.json()["id"]
+
+    assert db.query(ErrorRecord).count() == 2
+    assert sorted(k for (k,) in db.query(ErrorIdempotencyKey.key)) == ["e1", "h1"]
+    assert len(handled) == 2
+
+
+def test_retry_after_the_key_left_the_cache_is_found_in_the_db(client, db, handled, monkeypatch):
+    monkeypatch.setattr(idempotency.idempotency_cache, "maxsize", 1)
+
+    first = _post(client, "k1").json()
+    _post(client, "k2")
+    assert idempotency.idempotency_cache.get("k1") is None  # evicted
+
+    assert _post(client, "k1").json() == first
+    # the DB hit warmed the cache again
+    assert idempotency.idempotency_cache.get("k1").id == first["id"]
+
+    idempotency.idempotency_cache.clear()  # e.g. another worker, or a restart
+    assert _post(client, "k1").json() == first
+
+    assert db.query(ErrorRecord).count() == 2
+    assert len(handled) == 2
+
+
+def test_concurrent_insert_of_the_same_key_returns_the_winner(client, db, handled, monkeypatch):
+    winner = ErrorRecord(machine="WEB01", message="boom", severity="ERROR", raw_payload="{}")
+    db.add(winner)
+    db.flush()
+    db.add(ErrorIdempotencyKey(key="k1", error_id=winner.id))
+    db.commit()
+    winner_id = winner.id
+
+    # both requests passed the lookup before either committed
+    monkeypatch.setattr(idempotency, "lookup", lambda db, key: None)
+
+    r = _post(client, "k1")
+    assert r.status_code == 201
+    assert r.json()["id"] == winner_id
+
+    # the loser's row and its escalations were rolled back, its actions never ran
+    assert db.query(ErrorRecord).count() == 1
+    assert handled == []
+    assert idempotency.idempotency_cache.get("k1").id == winner_id
@@ -0,0 +1,92 @@
+import asyncio
+import socket
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from error_service.db import SessionLocal
+from error_service.models import ErrorRecord
+from error_service.services import line_listener, spool as spool_mod
+from error_service.services.line_listener import LineListener, parse_line
+from error_service.services.spool import Spool
+
+
+def test_parse_line():
+    assert parse_line("<13>web01 warn disk full") == ("WEB01", "WARN", "disk full")
+    assert parse_line("web01 something broke") == ("WEB01", "ERROR", "something broke")
+    assert parse_line("web01") is None
+    assert parse_line("x" * 51 + " ERROR boom") is None
+
+
+def test_db_down_spools_whole_batch_with_one_fsync(db, tmp_path, monkeypatch):
+    fsyncs = []
+    monkeypatch.setattr(spool_mod.os, "fsync", lambda fd: fsyncs.append(fd))
+
+    def db_down(*args, **kwargs):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(line_listener, "insert_many", db_down)
+
+    spool = Spool(str(tmp_path / "lines.spool"), fsync=True)
+    listener = LineListener(session_factory=lambda: db, on_insert=lambda out, db: lambda: None, spool=spool)
+    batch = [(f"M{i}", "ERROR", f"boom {i}", "udp", f"M{i} ERROR boom {i}") for i in range(500)]
+
+    listener._store_batch(batch)
+
+    assert listener.counters["spooled"] == 500
+    assert len(fsyncs) == 1
+    records, _ = spool.read_batch(1000)
+    assert [r["machine"] for r in records] == [f"M{i}" for i in range(500)]
+
+
+def _free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_tcp_and_udp_lines_are_batch_inserted_and_handled(db, tmp_path):
+    handled = []
+
+    def on_insert(out, db):
+        if out.message == "poison":
+            raise RuntimeError("rule lookup failed")
+        return lambda: handled.append((out.id, out.machine, out.severity, out.message))
+
+    listener = LineListener(session_factory=SessionLocal, on_insert=on_insert, spool=Spool(str(tmp_path / "lines.spool"), fsync=False))
+    tcp_port, udp_port = _free_port(socket.SOCK_STREAM), _free_port(socket.SOCK_DGRAM)
+
+    async def scenario():
+        await listener.start("127.0.0.1", tcp_port, udp_port)
+
+        # a sender that never disconnects, like a PLC
+        _, writer = await asyncio.open_connection("127.0.0.1", tcp_port)
+        writer.write(b"".join(f"plc{i % 3} WARN line {i}\n".encode() for i in range(200)) + b"plc0 ERROR poison\nbad\n")
+        await writer.drain()
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as u:
+            u.sendto(b"<13>udp1 CRITICAL boom\nudp2 hmm\n", ("127.0.0.1", udp_port))
+
+        deadline = time.monotonic() + 5
+        while listener.counters["inserted"] < 203 and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+
+        # must not wait for the open connection
+        await asyncio.wait_for(listener.stop(), 5)
+        writer.close()
+
+    asyncio.run(scenario())
+
+    assert listener.counters["inserted"] == 203
+    assert listener.counters["malformed"] == 1
+    assert listener.counters["batches"] < 203  # multi-row inserts
+
+    stored = db.query(ErrorRecord).order_by(ErrorRecord.id).all()
+    assert len(stored) == 203
+    assert {(r.machine, r.severity, r.message) for r in stored} >= {
+        ("PLC0", "WARN", "line 0"), ("UDP1", "CRITICAL", "boom"), ("UDP2", "ERROR", "hmm"),
+    }
+
+    # everything but the poisoned event went through post-store handling, ids match the rows
+    assert len(handled) == 202
+    assert {h[0] for h in handled} == {r.id for r in stored if r.message != "poison"}
@@ -0,0 +1,32 @@
+import pytest
+
+from error_service.services import profiling
+
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "secret")
+
+
+def test_profiled_request_gets_report(client):
+    r = client.get("/errors", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    assert r.status_code == 200
+    assert int(r.headers["X-Query-Count"]) >= 1
+
+    report = client.get(f"/admin/profiles/{r.headers['X-Profile-Id']}", headers={"X-Admin-Token": "secret"}).json()
+    assert report["path"] == "/errors"
+    assert report["status"] == 200
+    assert report["query_count"] == int(r.headers["X-Query-Count"])
+    assert "cumulative" in report["profile"]
+
+
+def test_profile_needs_admin_token(client):
+    r = client.get("/errors", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert r.status_code == 200
+    assert "X-Profile-Id" not in r.headers
+
+
+def test_query_count_warning(client, monkeypatch, capsys):
+    monkeypatch.setattr(profiling, "QUERY_COUNT_WARN", 1)
+    client.post("/errors", json={"machine": "m", "message": "x"})
+    assert "[PERF] WARNING POST /errors" in capsys.readouterr().out
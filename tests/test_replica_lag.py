@@ -0,0 +1,51 @@
+import time
+
+from sqlalchemy import create_engine, text
+
+from error_service import db as db_mod
+from error_service.db import _Heartbeat, _ReplicaLag
+from error_service.models import ReplicaHeartbeat
+
+
+def _engine(path):
+    e = create_engine(f"sqlite:///{path}")
+    ReplicaHeartbeat.__table__.create(e)
+    return e
+
+
+def _copy_heartbeat(primary, replica):
+    # stand-in for replication
+    with primary.connect() as conn:
+        beat_at = conn.execute(text("SELECT beat_at FROM replica_heartbeat WHERE id = 1")).scalar()
+    with replica.begin() as conn:
+        conn.execute(text("DELETE FROM replica_heartbeat"))
+        conn.execute(text("INSERT INTO replica_heartbeat (id, beat_at) VALUES (1, :t)"), {"t": beat_at})
+
+
+def test_lag_comes_from_the_replica_not_local_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_mod, "READ_PROBE_INTERVAL_SECONDS", 0.0)
+    primary, replica = _engine(tmp_path / "p.db"), _engine(tmp_path / "r.db")
+    lag = _ReplicaLag(replica)
+
+    # nothing replicated yet: lag unknown, use the primary
+    assert not lag.fresh()
+
+    hb = _Heartbeat(primary)
+    hb.beat()
+    _copy_heartbeat(primary, replica)
+    assert lag.fresh()
+    assert lag.lag_seconds < 1
+
+    # replica stops applying changes while the primary keeps beating
+    monkeypatch.setattr(db_mod.time, "time", lambda real=time.time: real() + db_mod.READ_MAX_STALENESS_SECONDS + 1)
+    hb.beat()
+    assert not lag.fresh()
+
+    _copy_heartbeat(primary, replica)
+    assert lag.fresh()
+
+
+def test_unreachable_replica_is_not_fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_mod, "READ_PROBE_INTERVAL_SECONDS", 0.0)
+    lag = _ReplicaLag(create_engine(f"sqlite:///{tmp_path}/missing/r.db"))
+    assert not lag.fresh()
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pytest
+
+from error_service.services import rule_matcher
+from error_service.services.rule_matcher import RuleMatcher
+
+
+def _pattern_rule(rule_id, pattern, pattern_type="regex"):
+    return SimpleNamespace(
+        id=rule_id, user_id=rule_id, target_group=None, machine_pattern=pattern, pattern_type=pattern_type,
+        min_severity="ERROR", do_email=True, do_call=False, do_halo_ticket=False,
+        digest_window_seconds=0, digest_bypass_critical=True, escalate_after_minutes=0,
+    )
+
+
+def test_backreference_patterns_still_match():
+    m = RuleMatcher([], [], [_pattern_rule(1, r"(A)\1"), _pattern_rule(2, r"(Q)\1.*")])
+    assert [t.rule_id for t in m.match("QQ7")] == [2]
+    assert [t.rule_id for t in m.match("AA")] == [1]
+    assert m.match("AQ") == ()
+
+
+def test_glob_and_regex_are_case_insensitive_full_matches():
+    m = RuleMatcher([], [], [_pattern_rule(1, "web-*", "glob"), _pattern_rule(2, r"db\d+")])
+    assert [t.rule_id for t in m.match("WEB-01")] == [1]
+    assert [t.rule_id for t in m.match("db12")] == [2]
+    assert m.match("db12x") == ()
+
+
+def test_rules_by_machine_includes_group_and_pattern_rules(client):
+    def user(email, last):
+        return client.post("/users", json={"first_name": "x", "last_name": last, "role": "ops", "email": email}).json()["id"]
+
+    a, b, c = user("a@x.io", "A"), user("b@x.io", "B"), user("c@x.io", "C")
+    svc = client.post("/services", json={"name": "WEB01", "group": "web"}).json()["id"]
+
+    client.post("/rules", json={"user_id": a, "service_id": svc, "do_email": True})
+    client.post("/rules/patterns", json={"user_id": b, "target_group": "web", "do_call": True})
+    client.post("/rules/patterns", json={"user_id": c, "machine_pattern": "WEB*", "do_halo_ticket": True})
+
+    rows = client.get("/rules/by-machine", params={"machine": "web01"}).json()
+    assert [(r["email"], r["rule_kind"]) for r in rows] == [
+        ("a@x.io", "service"), ("b@x.io", "group"), ("c@x.io", "pattern"),
+    ]
+
+    # no service at all, only the pattern applies
+    rows = client.get("/rules/by-machine", params={"machine": "web99"}).json()
+    assert [r["email"] for r in rows] == ["c@x.io"]
+
+
+def test_rebuilds_reuse_compiled_patterns():
+    rules = [_pattern_rule(1, "web-*", "glob"), _pattern_rule(2, r"db\d+")]
+    a, b = RuleMatcher([], [], rules), RuleMatcher([], [], rules)
+    assert [rx for rx, _ in a._patterns] == [rx for rx, _ in b._patterns]
+    assert all(x is y for (x, _), (y, _) in zip(a._patterns, b._patterns))
+
+
+@pytest.fixture
+def matcher_state():
+    rule_matcher.invalidate()
+    yield
+    rule_matcher.invalidate()
+
+
+def test_expired_snapshot_is_served_while_another_caller_rebuilds(db, matcher_state, monkeypatch):
+    first = rule_matcher.get_matcher(db)
+    monkeypatch.setattr(rule_matcher, "RULE_MATCHER_TTL_SECONDS", 0)
+
+    # another request is rebuilding: don't wait for it
+    with rule_matcher._lock:
+        assert rule_matcher.get_matcher(db) is first
+
+    # nobody is: this caller refreshes
+    second = rule_matcher.get_matcher(db)
+    assert second is not first
+    assert rule_matcher._matcher is second
+
+
+def test_invalidate_is_never_answered_with_the_old_snapshot(db, matcher_state):
+    first = rule_matcher.get_matcher(db)
+    assert rule_matcher.get_matcher(db) is first
+
+    rule_matcher.invalidate()
+    second = rule_matcher.get_matcher(db)
+    assert second is not first
+    assert second.generation == rule_matcher._generation
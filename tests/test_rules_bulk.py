@@ -0,0 +1,116 @@
+from sqlalchemy.exc import IntegrityError
+
+from error_service.models import NotificationRule, User
+from error_service.repositories import rules as rules_repo
+from error_service.repositories.rules import IN_CHUNK_SIZE
+
+
+def _service(client, name):
+    return client.post("/services", json={"name": name, "group": "web"}).json()["id"]
+
+
+def _new_user(email):
+    return {"first_name": "x", "last_name": "y", "role": "ops", "email": email}
+
+
+def _bulk(client, items):
+    return client.post("/rules/bulk", json={"rules": items})
+
+
+def test_one_user_per_email_whatever_the_case(client, db):
+    a, b, c = _service(client, "WEB01"), _service(client, "WEB02"), _service(client, "WEB03")
+    existing = client.post("/users", json=_new_user("old@x.io")).json()["id"]
+
+    r = _bulk(client, [
+        {"service_id": a, "user": _new_user("Ops@X.io")},
+        {"service_id": b, "user": _new_user("ops@x.io")},
+        {"service_id": c, "user": _new_user(" OPS@x.IO ")},
+        {"service_id": a, "user": _new_user("OLD@X.IO")},
+    ]).json()
+
+    assert (r["created"], r["updated"], r["failed"]) == (4, 0, 0)
+    users = {u.email: u.id for u in db.query(User)}
+    assert users.keys() == {"ops@x.io", "old@x.io"}
+    assert {res["rule"]["user_id"] for res in r["results"][:3]} == {users["ops@x.io"]}
+    assert r["results"][3]["rule"]["user_id"] == existing
+
+
+def test_invalid_items_are_reported_and_create_no_users(client, db):
+    svc = _service(client, "WEB01")
+
+    r = _bulk(client, [
+        {"service_id": 999999, "user": _new_user("ghost@x.io")},
+        {"service_id": svc, "user_id": 999999},
+        {"service_id": svc},
+        {"service_id": svc, "user": _new_user("real@x.io")},
+    ]).json()
+
+    assert (r["created"], r["updated"], r["failed"]) == (1, 0, 3)
+    assert [res["status"] for res in r["results"]] == ["error", "error", "error", "created"]
+    assert r["results"][0]["detail"] == "Unknown service_id"
+    assert [u.email for u in db.query(User)] == ["real@x.io"]
+
+
+def test_last_item_wins_for_a_repeated_pair(client, db):
+    svc = _service(client, "WEB01")
+    user = client.post("/users", json=_new_user("a@x.io")).json()["id"]
+
+    r = _bulk(client, [
+        {"service_id": svc, "user_id": user, "min_severity": "INFO", "do_email": True},
+        {"service_id": svc, "user_id": user, "min_severity": "CRITICAL", "do_call": True},
+    ]).json()
+    assert [res["status"] for res in r["results"]] == ["created", "updated"]
+
+    (rule,) = db.query(NotificationRule).all()
+    assert (rule.min_severity, rule.do_email, rule.do_call) == ("CRITICAL", False, True)
+
+    # same for a rule that already exists
+    r = _bulk(client, [
+        {"service_id": svc, "user_id": user, "min_severity": "WARN"},
+        {"service_id": svc, "user_id": user, "min_severity": "ERROR", "do_halo_ticket": True},
+    ]).json()
+    assert [res["status"] for res in r["results"]] == ["updated", "updated"]
+    assert {res["rule"]["id"] for res in r["results"]} == {rule.id}
+
+    db.expire_all()
+    (rule,) = db.query(NotificationRule).all()
+    assert (rule.min_severity, rule.do_halo_ticket) == ("ERROR", True)
+
+
+def test_batches_larger_than_one_in_chunk(client, db):
+    services = [_service(client, f"WEB{i:02d}") for i in range(3)]
+    n = 2 * IN_CHUNK_SIZE + 100
+
+    created = _bulk(client, [
+        {"service_id": services[i % 3], "user": _new_user(f"u{i}@x.io")} for i in range(n)
+    ]).json()
+    assert (created["created"], created["failed"]) == (n, 0)
+    assert db.query(User).count() == n
+
+    # the same pairs again, now by user id: every lookup spans several chunks
+    user_ids = [res["rule"]["user_id"] for res in created["results"]]
+    updated = _bulk(client, [
+        {"service_id": services[i % 3], "user_id": user_ids[i], "min_severity": "CRITICAL"} for i in range(n)
+    ]).json()
+    assert (updated["created"], updated["updated"], updated["failed"]) == (0, n, 0)
+    assert db.query(NotificationRule).count() == n
+    assert db.query(NotificationRule).filter(NotificationRule.min_severity == "CRITICAL").count() == n
+
+
+def test_conflict_answers_409_and_writes_nothing(client, db, monkeypatch):
+    svc = _service(client, "WEB01")
+    insert_many = rules_repo.insert_many
+
+    def conflicting(db, model, rows):
+        if model is NotificationRule:
+            raise IntegrityError("INSERT INTO notification_rules", {}, Exception("UNIQUE constraint failed"))
+        return insert_many(db, model, rows)
+
+    monkeypatch.setattr(rules_repo, "insert_many", conflicting)
+
+    r = _bulk(client, [{"service_id": svc, "user": _new_user("new@x.io")}])
+    assert r.status_code == 409
+
+    # the user inserted earlier in the same transaction is gone too
+    assert db.query(User).count() == 0
+    assert db.query(NotificationRule).count() == 0
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+
+from error_service.models import ErrorIdempotencyKey, ErrorRecord
+from error_service.db import SessionLocal
+from error_service.services import spool as spool_mod
+from error_service.services.spool import Spool, SpoolReplayer, to_record
+
+
+class Crash(Exception):
+    pass
+
+
+def _record(i):
+    return to_record(f"k{i}", f"M{i}", f"boom {i}", "ERROR", "{}")
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / "errors.spool"), fsync=True)
+
+
+def test_torn_tail_is_cut_on_reopen(spool):
+    for i in range(3):
+        spool.append(_record(i))
+
+    # crash halfway through a fourth frame
+    with open(spool.path, "ab") as f:
+        f.write(spool._frame(_record(3))[:-5])
+
+    reopened = Spool(spool.path)
+    records, _ = reopened.read_batch(10)
+    assert [r["key"] for r in records] == ["k0", "k1", "k2"]
+
+    # appends after recovery land right after the last good record
+    reopened.append(_record(4))
+    records, _ = reopened.read_batch(10)
+    assert [r["key"] for r in records] == ["k0", "k1", "k2", "k4"]
+
+
+def test_corrupt_frame_stops_the_read(spool):
+    spool.append(_record(0))
+    good = spool.pending_bytes()
+    spool.append(_record(1))
+
+    with open(spool.path, "r+b") as f:
+        f.seek(good + 10)
+        f.write(b"X")
+
+    records, _ = Spool(spool.path).read_batch(10)
+    assert [r["key"] for r in records] == ["k0"]
+
+
+def test_concurrent_appends_are_group_committed(spool, monkeypatch):
+    fsyncs = []
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        time.sleep(0.05)
+
+    monkeypatch.setattr(spool_mod.os, "fsync", slow_fsync)
+
+    threads = [threading.Thread(target=spool.append, args=(_record(i),)) for i in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    records, _ = spool.read_batch(100)
+    assert sorted(r["key"] for r in records) == sorted(f"k{i}" for i in range(50))
+    # appends arriving during an fsync share the next one
+    assert len(fsyncs) < 10
+
+
+def _replayer(spool, stored):
+    return SpoolReplayer(spool, SessionLocal, on_insert=lambda out, db: lambda: stored.append(out.id))
+
+
+def test_replay_stores_each_event_once(db, spool):
+    for i in range(5):
+        spool.append(_record(i))
+
+    stored = []
+    r = _replayer(spool, stored)
+    assert r.replay_once() == 5
+    assert r.replay_once() == 0
+    assert spool.pending_bytes() == 0
+
+    assert db.query(ErrorRecord).count() == 5
+    assert sorted(k for (k,) in db.query(ErrorIdempotencyKey.key)) == [f"k{i}" for i in range(5)]
+    assert len(stored) == 5
+
+
+def test_replay_after_crash_before_offset_commit_skips_stored_events(db, spool, monkeypatch):
+    for i in range(3):
+        spool.append(_record(i))
+
+    # rows committed, then the process dies before the offset is saved
+    def crash(offset):
+        raise Crash()
+
+    monkeypatch.setattr(spool, "commit", crash)
+    with pytest.raises(Crash):
+        _replayer(spool, []).replay_once()
+    monkeypatch.undo()
+
+    spool.append(_record(3))
+    r = _replayer(spool, [])
+    r.replay_once()
+
+    assert r.skipped_duplicates == 3
+    assert r.replayed == 1
+    assert db.query(ErrorRecord).count() == 4
+
+
+def test_event_already_stored_over_http_is_not_replayed(db, spool):
+    rec = ErrorRecord(machine="M0", message="boom 0", severity="ERROR", raw_payload="{}")
+    db.add(rec)
+    db.flush()
+    db.add(ErrorIdempotencyKey(key="k0", error_id=rec.id))
+    db.commit()
+
+    spool.append(_record(0))
+    r = _replayer(spool, [])
+    r.replay_once()
+
+    assert r.skipped_duplicates == 1
+    assert db.query(ErrorRecord).count() == 1
+
+
+def test_failing_post_store_handling_does_not_skip_the_rest_of_the_batch(db, spool):
+    for i in range(4):
+        spool.append(_record(i))
+
+    handled = []
+
+    def on_insert(out, db):
+        if out.machine == "M1":
+            raise RuntimeError("rule lookup failed")
+
+        def after_commit():
+            if out.machine == "M2":
+                raise RuntimeError("notification failed")
+            handled.append(out.machine)
+
+        return after_commit
+
+    r = SpoolReplayer(spool, SessionLocal, on_insert=on_insert)
+    assert r.replay_once() == 4
+
+    assert handled == ["M0", "M3"]
+    assert db.query(ErrorRecord).count() == 4
+    assert spool.pending_bytes() == 0